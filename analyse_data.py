@@ -1,30 +1,135 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from statsmodels.tsa.stattools import ccf
+from scipy.fft import irfft, next_fast_len, rfft
 
-from load_data import load_dataset
+from load_data import load_dataset, load_index, read_recording
 
-def calculate_correlations(recordings: list) -> dict:
+def calculate_correlations(
+        recordings: list,
+        n_jobs: int = 1,
+        batch_size: int = 16
+) -> dict:
     """
     Calculate lag with maximal cross-correlation between gaze and stimulus,
     for 'x' and 'y' coordinates separately.
 
+    The cross-correlation functions of all recordings and coordinates are
+    computed together with batched FFTs, see _calculate_ccfs().
+
     :param recordings: List of recordings (as Pandas DataFrame).
+    :param n_jobs: Number of workers used for the FFTs. If -1, one worker per
+        CPU core is used. Defaults to 1.
+    :param batch_size: Maximal number of series transformed together, see
+        _calculate_ccfs(). Defaults to 16.
     :return: Dictionary of lags with maximal correlation for 'x' and 'y' axis.
     """
-    correlations = {'x': [], 'y': []}
+    coords = ['x', 'y']
+    gaze, stimulus = [], []
 
     for df in recordings:
-        for cord in ['x', 'y']:
-            corr = _calculate_ccf(
-                df[f'Gaze_{cord}'].to_numpy(),
-                df[f'Stimulus_{cord}'].to_numpy()
+        for cord in coords:
+            gaze.append(df[f'Gaze_{cord}'].to_numpy())
+            stimulus.append(df[f'Stimulus_{cord}'].to_numpy())
+
+    corr = _calculate_ccfs(
+        gaze,
+        stimulus,
+        n_jobs=n_jobs,
+        batch_size=batch_size
+    )
+    lags = np.argmax(corr, axis=1)
+    lags -= 256
+
+    return {cord: list(lags[i::len(coords)]) for i, cord in enumerate(coords)}
+
+def analyse_lags(
+        folder: str = None,
+        cache: bool = True,
+        cache_dir: str = None,
+        n_jobs: int = 1
+) -> dict:
+    """
+    Calculate the lags with maximal cross-correlation between gaze and
+    stimulus for each task. The dataset is indexed once and recordings are
+    grouped by the task given in the index, while recordings without a task
+    are skipped. Each recording is read once, only with its gaze and stimulus
+    columns.
+
+    :param folder: See load_dataset().
+    :param cache: See load_dataset().
+    :param cache_dir: See load_dataset().
+    :param n_jobs: See calculate_correlations().
+    :return: Dictionary mapping each task (e.g. '1-saccades') to the lags of
+        its recordings (training data first), see calculate_correlations().
+    """
+    index = load_index(folder=folder)
+    infos = {entry.path: entry for entry in index.entries}
+    train_files, test_files = index.select(task='all', split='both')
+
+    groups = {}
+    for fp in train_files + test_files:
+        info = infos[fp]
+
+        if info.level is None or info.paradigm is None:
+            continue
+
+        groups.setdefault(f'{info.level}-{info.paradigm}', []).append(fp)
+
+    results = {}
+    for task in sorted(groups):
+        recordings = [
+            read_recording(
+                fp,
+                cache=cache,
+                cache_dir=cache_dir,
+                columns=['Gaze_x', 'Gaze_y', 'Stimulus_x', 'Stimulus_y']
             )
-            max_corr = np.argmax(corr) - 256
-            correlations[cord].append(max_corr)
+            for fp in groups[task]
+        ]
+        results[task] = calculate_correlations(recordings, n_jobs=n_jobs)
 
-    return correlations
+    return results
+
+def track_lags(
+        recording: pd.DataFrame,
+        window_length: int = 2560,
+        hop: int = 256,
+        min_lag: int = -256,
+        max_lag: int = 511
+) -> pd.DataFrame:
+    """
+    Track the lag with maximal correlation between gaze and stimulus over
+    time, using sliding windows, see LagTracker.
+
+    :param recording: Recording containing stimulus and gaze data.
+    :param window_length: Number of stimulus samples per window. Defaults to
+        2560 (10 s at 256 Hz).
+    :param hop: Number of samples between the starts of consecutive windows.
+        Defaults to 256.
+    :param min_lag: Smallest lag (in samples). Defaults to -256.
+    :param max_lag: Largest lag (in samples). Defaults to 511.
+    :return: DataFrame with the timestamp of the center of each window and
+        the lags of the 'x' and 'y' coordinate.
+    """
+    tracker = LagTracker(
+        n_coords=2,
+        window_length=window_length,
+        hop=hop,
+        min_lag=min_lag,
+        max_lag=max_lag
+    )
+    starts, lags = tracker.update(
+        recording[['Gaze_x', 'Gaze_y']].to_numpy(dtype=float),
+        recording[['Stimulus_x', 'Stimulus_y']].to_numpy(dtype=float)
+    )
+    timestamp = recording['Timestamp'].to_numpy()
+
+    return pd.DataFrame({
+        'Timestamp': timestamp[starts + window_length // 2],
+        'x': lags[:, 0],
+        'y': lags[:, 1]
+    })
 
 def visualize_ccf(recording: pd.DataFrame, coord: str = 'x'):
     """
@@ -50,28 +155,249 @@ def _calculate_ccf(x: np.ndarray, y: np.ndarray) -> np.ndarray:
     """
     Auxiliary function to calculate cross-correlation function of two time series.
 
+    All lags from -255 to 511 are computed with a single FFT and normalized
+    as statsmodels' ccf(x, y, adjusted=False). The layout matches the former
+    concatenation of ccf(y, x, nlags=256)[::-1] and ccf(x, y, nlags=512),
+    i.e. lag 0 is contained twice and index 256 corresponds to lag 0.
+
     :param x: First time series, as NumPy array.
     :param y: Second time series, as NumPy array.
     :return: Cross-correlation function, as NumPy array.
     """
-    corr = ccf(x, y, adjusted=False, nlags=512)
-    corr_inv = ccf(y, x, adjusted=False, nlags=256)[::-1]
-    corr = np.concatenate((corr_inv, corr))
+    return _calculate_ccfs([x], [y])[0]
+
+
+def _calculate_ccfs(
+        xs: list,
+        ys: list,
+        n_jobs: int = 1,
+        batch_size: int = 16
+) -> np.ndarray:
+    """
+    Auxiliary function to calculate the cross-correlation functions of several
+    pairs of time series, see _calculate_ccf().
+
+    Pairs are bucketed by length (powers of two) and the pairs of a bucket are
+    zero-padded to a common FFT length and transformed together, in batches
+    of at most batch_size pairs. Zero-padding beyond the lags does not change
+    the result.
+
+    :param xs: List of first time series, as NumPy arrays.
+    :param ys: List of second time series, of the same lengths as xs.
+    :param n_jobs: Number of workers used by scipy.fft. If -1, one worker per
+        CPU core is used. Defaults to 1.
+    :param batch_size: Maximal number of pairs transformed together, which
+        bounds the memory to about 56 * batch_size * n_samples bytes. Defaults
+        to 16.
+    :return: Cross-correlation functions, as NumPy array of shape
+        (len(xs), 768).
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer.")
+
+    lengths = np.array([len(x) for x in xs], dtype=int)
+    corr = np.empty((len(xs), 768))
+
+    buckets = {}
+    for i in np.argsort(lengths, kind='stable'):
+        buckets.setdefault(int(lengths[i] + 511).bit_length(), []).append(i)
+
+    batches = [bucket[start:start + batch_size]
+               for bucket in buckets.values()
+               for start in range(0, len(bucket), batch_size)]
+
+    for idx in batches:
+        n_fft = next_fast_len(int(lengths[idx].max()) + 512, real=True)
+        x_batch = np.zeros((len(idx), n_fft))
+        y_batch = np.zeros((len(idx), n_fft))
+        scale = np.empty(len(idx))
+
+        for row, i in enumerate(idx):
+            x_batch[row, :lengths[i]] = xs[i] - np.mean(xs[i])
+            y_batch[row, :lengths[i]] = ys[i] - np.mean(ys[i])
+            scale[row] = lengths[i] * np.std(xs[i]) * np.std(ys[i])
+
+        x_fft = rfft(x_batch, axis=1, workers=n_jobs)
+        y_fft = rfft(y_batch, axis=1, workers=n_jobs)
+        del x_batch, y_batch
+
+        # cross[k] = sum_t x[t + k] * y[t], negative lags wrap around
+        x_fft *= np.conj(y_fft)
+        del y_fft
+        cross = irfft(x_fft, n_fft, axis=1, workers=n_jobs)
+        cross /= scale[:, None]
+
+        corr[idx] = np.concatenate(
+            (cross[:, n_fft - 255:], cross[:, :1], cross[:, :512]), axis=1
+        )
 
     return corr
 
 
+class LagTracker:
+    """
+    Sliding-window estimator of the lag with maximal correlation between gaze
+    and stimulus, for data arriving in chunks, e.g. during live recording.
+
+    Window i covers the stimulus samples [s, s + window_length) with
+    s = i * hop - min_lag, which are correlated (Pearson) with the gaze
+    samples shifted by each lag. A positive lag means that the gaze follows
+    the stimulus. A window is complete once the gaze up to s + window_length
+    + max_lag has arrived.
+
+    Instead of recomputing each window, the sums over the window are updated
+    by adding the samples entering and subtracting the samples leaving it,
+    i.e. O(hop * n_lags) per window. To bound rounding errors, the sums are
+    recomputed from scratch after every window_length samples.
+    """
+    def __init__(
+            self,
+            n_coords: int = 2,
+            window_length: int = 2560,
+            hop: int = 256,
+            min_lag: int = -256,
+            max_lag: int = 511
+    ):
+        """
+        :param n_coords: Number of coordinates, tracked independently.
+            Defaults to 2.
+
+        See the description of track_lags() for a description of the
+        remaining keyword arguments.
+        """
+        if hop < 1 or hop > window_length:
+            raise ValueError("hop must be between 1 and window_length.")
+
+        if min_lag > 0 or max_lag < 0:
+            raise ValueError("The lags must contain 0.")
+
+        self.n_coords = n_coords
+        self.window_length = window_length
+        self.hop = hop
+        self.min_lag = min_lag
+        self.max_lag = max_lag
+        self.refresh = -(-window_length // hop)
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the tracker, such that the next chunk is the start of a new
+        recording.
+        """
+        self.gaze = np.empty((0, self.n_coords))
+        self.stimulus = np.empty((0, self.n_coords))
+        self.offset = 0
+        self.n_windows = 0
+        self.n_updates = 0
+        self.sums = None
+
+    def update(
+            self,
+            gaze: np.ndarray,
+            stimulus: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Add the next chunk of gaze and stimulus data and estimate the lags of
+        all windows completed by it.
+
+        :param gaze: NumPy array of shape (n_samples, n_coords).
+        :param stimulus: NumPy array of shape (n_samples, n_coords).
+        :return: Tuple of the first stimulus sample of each completed window
+            (counted from the start of the recording), as NumPy array of
+            shape (n_windows,), and the lags, as NumPy array of shape
+            (n_windows, n_coords). Lags are NaN where the correlation is
+            undefined, e.g. for a constant stimulus.
+        """
+        gaze = np.asarray(gaze, dtype=float).reshape(-1, self.n_coords)
+        stimulus = np.asarray(stimulus, dtype=float).reshape(-1, self.n_coords)
+        self.gaze = np.concatenate((self.gaze, gaze))
+        self.stimulus = np.concatenate((self.stimulus, stimulus))
+
+        starts, lags = [], []
+        n_samples = self.offset + len(self.gaze)
+        start = self.n_windows * self.hop - self.min_lag
+
+        while start + self.window_length + self.max_lag <= n_samples:
+            end = start + self.window_length
+
+            if self.sums is None or self.n_updates == self.refresh:
+                self.sums = self._block_sums(start, end)
+                self.n_updates = 0
+            else:
+                entering = self._block_sums(end - self.hop, end)
+                leaving = self._block_sums(start - self.hop, start)
+                self.sums = [total + new - old for total, new, old
+                             in zip(self.sums, entering, leaving)]
+                self.n_updates += 1
+
+            starts.append(start)
+            lags.append(self._lags())
+            self.n_windows += 1
+            start += self.hop
+
+        # Keep the samples leaving the window with the next hop
+        drop = max(start - self.hop + self.min_lag - self.offset, 0)
+        self.gaze = self.gaze[drop:]
+        self.stimulus = self.stimulus[drop:]
+        self.offset += drop
+
+        return (np.array(starts, dtype=int),
+                np.array(lags, dtype=float).reshape(-1, self.n_coords))
+
+    def _block_sums(self, t0: int, t1: int) -> list:
+        """
+        Auxiliary method to calculate the sums of the stimulus samples
+        [t0, t1) and the gaze samples shifted by each lag.
+
+        :return: List of the sums of stimulus times gaze, gaze, squared gaze,
+            stimulus and squared stimulus.
+        """
+        stimulus = self.stimulus[t0 - self.offset:t1 - self.offset]
+        gaze = np.lib.stride_tricks.sliding_window_view(
+            self.gaze[t0 + self.min_lag - self.offset:
+                      t1 + self.max_lag - self.offset],
+            self.max_lag - self.min_lag + 1,
+            axis=0
+        )
+
+        return [
+            np.einsum('tc,tcl->cl', stimulus, gaze),
+            gaze.sum(axis=0),
+            np.einsum('tcl,tcl->cl', gaze, gaze),
+            stimulus.sum(axis=0),
+            np.einsum('tc,tc->c', stimulus, stimulus)
+        ]
+
+    def _lags(self) -> np.ndarray:
+        """
+        Auxiliary method to calculate the lags with maximal correlation from
+        the sums of the current window.
+        """
+        cross, gaze, gaze_sq, stimulus, stimulus_sq = self.sums
+        n = self.window_length
+
+        cov = cross - gaze * stimulus[:, None] / n
+        var_gaze = gaze_sq - gaze ** 2 / n
+        var_stimulus = stimulus_sq - stimulus ** 2 / n
+        var = var_gaze * var_stimulus[:, None]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(var > 0, cov / np.sqrt(var), np.nan)
+
+        valid = ~np.isnan(corr).all(axis=1)
+        lags = np.full(self.n_coords, np.nan)
+        lags[valid] = np.nanargmax(corr[valid], axis=1) + self.min_lag
+
+        return lags
+
+
 if __name__ == '__main__':
     # Visualize a single cross-correlation function
-    recording = load_dataset()[0][0]
+    recording = load_dataset(lazy=True)[0][0]
     visualize_ccf(recording)
 
     # Calculate maximal lag of cross-correlation function for all files
-    for task in ['1-saccades', '1-smooth', '2-saccades', '2-smooth']:
-        recordings = load_dataset(task=task)
-        recordings_flat = recordings[0] + recordings[1]
-        corr = calculate_correlations(recordings_flat)
-
+    for task, corr in analyse_lags().items():
         print(f"Average lag between gaze and stimulus for {task} experiments.")
         for k, v in corr.items():
             print(k, np.mean(v), np.std(v))
@@ -0,0 +1,405 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+TASKS = ['level-1-smooth', 'level-1-saccades',
+         'level-2-smooth', 'level-2-saccades']
+STAGES = ['fetch', 'load_csv', 'build_cache', 'load_cached', 'filter',
+          'filter_chunked', 'correlate', 'impute']
+# Block size of the stage 'filter_chunked', larger than the transient of the
+# default filter (3941 samples)
+CHUNK_SIZE = 16384
+
+
+def make_synthetic_dataset(
+        folder: str,
+        n_recordings: int,
+        n_samples: int,
+        fs: int = 256,
+        seed: int = 0
+):
+    """
+    Function to write a synthetic dataset with the layout and columns of the
+    preprocessed EEG Eye-Tracking Dataset. The gaze follows the stimulus with
+    a delay of 0.25 s and EEG channels contain short runs of zeros, such that
+    every stage of the data path has work to do.
+
+    :param folder: Path to the folder the dataset is written to.
+    :param n_recordings: Number of recordings, split evenly between training
+        and test data and cycled through the tasks.
+    :param n_samples: Number of samples per recording.
+    :param fs: Sample frequency. Defaults to 256 Hz.
+    :param seed: Seed of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+
+    for i in range(n_recordings):
+        split = 'train' if i % 2 == 0 else 'test'
+        participant, session = divmod(i // 2, len(TASKS))
+        task = TASKS[session]
+
+        stimulus = np.cumsum(rng.normal(size=(n_samples, 2)), axis=0)
+        gaze = np.roll(stimulus, fs // 4, axis=0)
+        gaze += rng.normal(size=(n_samples, 2))
+        eeg = 800 + 50 * rng.normal(size=(n_samples, 4))
+
+        for channel in range(4):
+            start = rng.integers(0, n_samples - 10)
+            eeg[start:start + rng.integers(3, 10), channel] = 0
+
+        recording = pd.DataFrame({
+            'Timestamp': np.arange(n_samples) / fs,
+            'EEG_TP9': eeg[:, 0],
+            'EEG_AF7': eeg[:, 1],
+            'EEG_AF8': eeg[:, 2],
+            'EEG_TP10': eeg[:, 3],
+            'Gaze_x': gaze[:, 0],
+            'Gaze_y': gaze[:, 1],
+            'Stimulus_x': stimulus[:, 0],
+            'Stimulus_y': stimulus[:, 1],
+        })
+
+        os.makedirs(os.path.join(folder, split), exist_ok=True)
+        name = f'P{participant + 1:03d}_{session + 1:02d}_{task}.csv'
+        recording.to_csv(os.path.join(folder, split, name), index=False)
+
+
+def reference_size(folder: str) -> tuple[int, int]:
+    """
+    Function to measure the size of a real dataset.
+
+    :param folder: Path to the folder containing the data.
+    :return: Tuple of number of recordings and mean number of samples per
+        recording.
+    """
+    from load_data import select_files
+
+    files = [fp for fps in select_files(folder=folder) for fp in fps]
+    n_samples = [_count_rows(fp) for fp in files]
+
+    return len(files), int(np.mean(n_samples))
+
+
+def run_stage(stage: str, folder: str, cache_dir: str, n_impute: int) -> dict:
+    """
+    Function to run a single stage of the data path and measure it. Meant to
+    be executed in a fresh process, such that the peak RSS belongs to the
+    stage only.
+
+    :param stage: Name of the stage, see STAGES.
+    :param folder: Path to the folder containing the data.
+    :param cache_dir: Path to the cache directory used by the load stages.
+    :param n_impute: Number of files processed by the imputation stage.
+    :return: Dictionary with wall time (in s), peak RSS (in MB) and
+        throughput (in samples per s, None for the stage 'fetch', which does
+        not process samples).
+    """
+    from load_data import filter_recording, load_dataset, select_files
+
+    def load(cache):
+        recordings = load_dataset(folder=folder, cache=cache,
+                                  cache_dir=cache_dir)
+        return recordings[0] + recordings[1]
+
+    if stage in ['filter', 'filter_chunked', 'correlate']:
+        recordings = load(cache=True)
+
+    start = time.perf_counter()
+
+    if stage == 'fetch':
+        select_files(folder=folder)
+        n_samples = None
+    elif stage == 'load_csv':
+        n_samples = sum(map(len, load(cache=False)))
+    elif stage in ['build_cache', 'load_cached']:
+        # The cache is empty for 'build_cache' and filled for 'load_cached'
+        n_samples = sum(map(len, load(cache=True)))
+    elif stage == 'filter':
+        n_samples = sum(len(filter_recording(rec, inplace=True))
+                        for rec in recordings)
+    elif stage == 'filter_chunked':
+        n_samples = sum(
+            len(filter_recording(rec, inplace=True, chunk_size=CHUNK_SIZE))
+            for rec in recordings
+        )
+    elif stage == 'correlate':
+        from analyse_data import calculate_correlations
+        calculate_correlations(recordings)
+        n_samples = sum(map(len, recordings))
+    elif stage == 'impute':
+        n_samples = _run_imputation(folder, n_impute)
+    else:
+        raise ValueError(f"Unknown stage '{stage}'.")
+
+    wall_time = time.perf_counter() - start
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    if stage == 'filter_chunked':
+        # Checked after the measurement, as the check filters the whole
+        # recording. The recordings are filtered in place, so reload one.
+        recording = load_dataset(folder=folder, cache_dir=cache_dir,
+                                 lazy=True)[0][0]
+        _check_chunked_filter(recording, chunk_size=CHUNK_SIZE)
+
+    return {
+        'wall_time_s': wall_time,
+        'peak_rss_mb': peak_rss / 1024,
+        'samples_per_s': (n_samples / wall_time
+                          if n_samples is not None and wall_time > 0 else None)
+    }
+
+
+def _check_chunked_filter(recording: pd.DataFrame, chunk_size: int):
+    """
+    Auxiliary function to check that filtering in blocks matches filtering
+    the whole recording, with the tolerance documented in filter_recording().
+
+    :param recording: Recording containing EEG data.
+    :param chunk_size: Number of samples per block.
+    """
+    from load_data import filter_recording
+
+    eeg_columns = [col for col in recording.columns if 'EEG' in col]
+    full = filter_recording(recording)[eeg_columns].to_numpy()
+    chunked = filter_recording(recording, chunk_size=chunk_size)
+    deviation = np.abs(chunked[eeg_columns].to_numpy() - full).max()
+    scale = np.abs(recording[eeg_columns].to_numpy()).max()
+
+    if deviation > 1e-6 * scale:
+        raise RuntimeError(
+            f'Chunked filter deviates by {deviation / scale:.2e} (relative) '
+            f'with chunk_size={chunk_size}.'
+        )
+
+
+def _run_imputation(folder: str, n_files: int) -> int:
+    """
+    Auxiliary function to run impute_missing_values.py on the first files of
+    the training data.
+
+    :param folder: Path to the folder containing the data.
+    :param n_files: Number of files to impute.
+    :return: Number of imputed samples (over all files).
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'impute_missing_values.py')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = os.path.join(tmp, 'input')
+        output_dir = os.path.join(tmp, 'output')
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+
+        train_dir = os.path.join(folder, 'train')
+        n_samples = 0
+        for name in sorted(os.listdir(train_dir))[:n_files]:
+            shutil.copy(os.path.join(train_dir, name), input_dir)
+            n_samples += _count_rows(os.path.join(input_dir, name))
+
+        process = subprocess.run(
+            [sys.executable, script, input_dir, output_dir],
+            capture_output=True, text=True
+        )
+
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else 'Imputation failed.')
+
+    return n_samples
+
+
+def _count_rows(fp: str) -> int:
+    """
+    Auxiliary function to count the rows of a CSV file, excluding the header.
+    """
+    with open(fp, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def _stage_worker(queue, *args):
+    """
+    Auxiliary function executed in the worker process of a stage.
+    """
+    try:
+        queue.put(run_stage(*args))
+    except Exception as e:
+        queue.put({'error': f'{type(e).__name__}: {e}'})
+
+
+def run_benchmark(
+        scales: list,
+        n_recordings: int,
+        n_samples: int,
+        stages: list = None,
+        work_dir: str = None,
+        n_impute: int = 2
+) -> dict:
+    """
+    Function to benchmark the data path on synthetic datasets of several
+    sizes. Each stage is run in a fresh process.
+
+    :param scales: List of scale factors, e.g. [1, 10, 100]. The number of
+        recordings is scaled, while the length of recordings is kept.
+    :param n_recordings: Number of recordings at scale 1.
+    :param n_samples: Number of samples per recording.
+    :param stages: List of stages to run. If None (Default), all STAGES are
+        run.
+    :param work_dir: Path to the folder for the synthetic datasets. If None
+        (Default), a temporary folder is used and removed afterward.
+    :param n_impute: Number of files processed by the imputation stage, which
+        is limited because of the duration of the ARIMA model search.
+    :return: Dictionary with the results.
+    """
+    stages = stages or STAGES
+    context = multiprocessing.get_context('spawn')
+    results = {
+        'commit': _git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'scales': []
+    }
+
+    tmp = None
+    if work_dir is None:
+        work_dir = tmp = tempfile.mkdtemp(prefix='eeg_benchmark_')
+
+    try:
+        for scale in scales:
+            folder = os.path.join(work_dir, f'data-{scale}x')
+            cache_dir = os.path.join(work_dir, f'cache-{scale}x')
+
+            if not os.path.isdir(folder):
+                make_synthetic_dataset(folder, scale * n_recordings, n_samples)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+            result = {
+                'scale': scale,
+                'n_recordings': scale * n_recordings,
+                'n_samples': scale * n_recordings * n_samples,
+                'stages': {}
+            }
+
+            for stage in stages:
+                queue = context.Queue()
+                process = context.Process(
+                    target=_stage_worker,
+                    args=(queue, stage, folder, cache_dir, n_impute)
+                )
+                process.start()
+                process.join()
+
+                result['stages'][stage] = (
+                    queue.get() if not queue.empty()
+                    else {'error': f'Exit code {process.exitcode}'}
+                )
+
+                print(f'{scale}x {stage}: {result["stages"][stage]}')
+
+            results['scales'].append(result)
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return results
+
+
+def _git_commit() -> str | None:
+    """
+    Auxiliary function to get the current git commit, if available.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="Path to the JSON file where the results will be saved.",
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Sizes of the synthetic datasets, relative to the base size.",
+    )
+    parser.add_argument(
+        "--reference-folder",
+        default=None,
+        help="Path to the real (preprocessed) dataset. If given, the base "
+             "size is the number of recordings and mean recording length of "
+             "this dataset.",
+    )
+    parser.add_argument(
+        "--recordings",
+        type=int,
+        default=8,
+        help="Number of recordings at scale 1, without reference folder.",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=256 * 300,
+        help="Number of samples per recording, without reference folder.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=None,
+        help="Stages to benchmark (default: all).",
+    )
+    parser.add_argument(
+        "--impute-files",
+        type=int,
+        default=2,
+        help="Number of files processed by the imputation stage.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Path to the directory for synthetic data (kept for reuse).",
+    )
+    args = parser.parse_args()
+
+    if args.reference_folder is not None:
+        n_recordings, n_samples = reference_size(args.reference_folder)
+    else:
+        n_recordings, n_samples = args.recordings, args.samples
+
+    results = run_benchmark(
+        args.scales,
+        n_recordings,
+        n_samples,
+        stages=args.stages,
+        work_dir=args.work_dir,
+        n_impute=args.impute_files
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
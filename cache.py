@@ -0,0 +1,492 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pooch
+
+from utils import ZipMember, read_csv
+
+CACHE_VERSION = 2
+
+
+def default_cache_dir() -> str:
+    """
+    Function to get the default directory of the columnar cache, which lives
+    next to the data managed by pooch.
+
+    :return: Path to the cache directory.
+    """
+    return os.path.join(pooch.os_cache("eeg_eye_tracking"), "columnar")
+
+
+def source_signature(fp: str | ZipMember) -> dict:
+    """
+    Function to compute the signature of a source file, which is used to
+    invalidate cached copies when the source changes. For members of a zip
+    archive, the signature of the archive is used.
+
+    :param fp: Path to the source file or ZipMember.
+    :return: Dictionary with size (in bytes) and modification time (in ns).
+    """
+    stat = os.stat(fp.archive if isinstance(fp, ZipMember) else fp)
+
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def cache_entry(
+        fp: str | ZipMember,
+        cache_dir: str = None,
+        variant: str = None
+) -> str:
+    """
+    Function to get the directory of the cache entry belonging to a source
+    file. Entries are keyed by the absolute path of the source file.
+
+    :param fp: Path to the source file or ZipMember.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :param variant: Name of a variant derived from the source file, e.g.
+        "64Hz" for a resampled recording. If None (Default), the entry of the
+        source file itself is returned.
+    :return: Path to the cache entry.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    if isinstance(fp, ZipMember):
+        path = f'{os.path.abspath(fp.archive)}/{fp.name}'
+    else:
+        path = os.path.abspath(fp)
+
+    key = hashlib.sha1(path.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    suffix = '' if variant is None else f'@{variant}'
+
+    return os.path.join(cache_dir, f'{stem}-{key}{suffix}')
+
+
+def column_groups(columns: list) -> dict:
+    """
+    Function to group columns by their prefix, e.g. "EEG_TP9" and "EEG_AF7"
+    are stored together in the group "EEG".
+
+    :param columns: List of column names.
+    :return: Dictionary mapping group names to lists of column names.
+    """
+    groups = {}
+    for col in columns:
+        groups.setdefault(col.split('_')[0], []).append(col)
+
+    return groups
+
+
+def read_meta(entry: str) -> dict | None:
+    """
+    Function to read the metadata of a cache entry.
+
+    :param entry: Path to the cache entry.
+    :return: Dictionary with metadata or None, if the entry does not exist.
+    """
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid(meta: dict | None, fp: str | ZipMember) -> bool:
+    """
+    Function to check whether a cache entry is up-to-date with its source.
+
+    :param meta: Metadata of the cache entry, as returned by read_meta().
+    :param fp: Path to the source file or ZipMember.
+    :return: True if the entry can be used, False otherwise.
+    """
+    return (meta is not None
+            and meta.get('version') == CACHE_VERSION
+            and meta.get('source') == source_signature(fp))
+
+
+def estimate_fs(recording: pd.DataFrame) -> float | None:
+    """
+    Function to estimate the sampling rate of a recording from its timestamps.
+
+    :param recording: Recording with column "Timestamp" (in seconds).
+    :return: Sampling rate in Hz or None, if it cannot be estimated.
+    """
+    if 'Timestamp' not in recording.columns or len(recording) < 2:
+        return None
+
+    period = np.median(np.diff(recording['Timestamp'].to_numpy()))
+
+    return round(float(1 / period), 2) if period > 0 else None
+
+
+def write_entry(
+        recording: pd.DataFrame,
+        fp: str | ZipMember,
+        cache_dir: str = None,
+        variant: str = None
+):
+    """
+    Function to write a recording to the cache, with one .npy file per column
+    group. The entry is written to a temporary directory first and moved into
+    place afterward, such that concurrent readers never see partial entries.
+    Failures (e.g. due to a read-only cache directory) are ignored, as the
+    recording can always be parsed again.
+
+    :param recording: Recording to store.
+    :param fp: Path to the source file of the recording or ZipMember.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :param variant: Name of the variant, see cache_entry().
+    """
+    entry = cache_entry(fp, cache_dir=cache_dir, variant=variant)
+
+    groups = column_groups(list(recording.columns))
+    meta = {
+        'version': CACHE_VERSION,
+        'source': source_signature(fp),
+        'columns': list(recording.columns),
+        'groups': groups,
+        'n_samples': len(recording),
+        'fs': estimate_fs(recording)
+    }
+
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp-')
+
+        for group, cols in groups.items():
+            np.save(os.path.join(tmp, f'{group}.npy'),
+                    recording[cols].to_numpy())
+
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    except OSError:
+        # Another process may have written the same entry concurrently, or
+        # the cache directory is not writable.
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_entry(
+        entry: str,
+        meta: dict,
+        columns: list = None,
+        dtype: type = None,
+        rows: slice = None
+) -> pd.DataFrame:
+    """
+    Function to read a cache entry as Pandas DataFrame. Only the column groups
+    containing the selected columns are read.
+
+    :param entry: Path to the cache entry.
+    :param meta: Metadata of the cache entry, as returned by read_meta().
+    :param columns: List of columns to read. If None (Default), all columns
+        are read.
+    :param dtype: Data type the columns are cast to. If None (Default), the
+        stored data type is kept.
+    :param rows: Slice of rows to read. If None (Default), all rows are read.
+    :return: Recording as Pandas DataFrame.
+    """
+    if columns is None:
+        columns = meta['columns']
+    if rows is None:
+        rows = slice(None)
+
+    missing = set(columns) - set(meta['columns'])
+    if missing:
+        raise ValueError(f'Columns {sorted(missing)} do not exist.')
+
+    data = {}
+    for group, cols in meta['groups'].items():
+        selected = [(i, col) for i, col in enumerate(cols) if col in columns]
+
+        if not selected:
+            continue
+
+        values = np.load(os.path.join(entry, f'{group}.npy'), mmap_mode='r')
+        data.update((col, np.array(values[rows, i], dtype=dtype))
+                    for i, col in selected)
+
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def read_groups(entry: str, meta: dict) -> dict:
+    """
+    Function to read the column groups of a cache entry as read-only memory
+    maps, such that processes reading the same entry share the page cache.
+
+    :param entry: Path to the cache entry.
+    :param meta: Metadata of the cache entry, as returned by read_meta().
+    :return: Dictionary mapping group names to NumPy memmaps of shape
+        (n_samples, n_columns).
+    """
+    return {group: np.load(os.path.join(entry, f'{group}.npy'), mmap_mode='r')
+            for group in meta['groups']}
+
+
+def load_memmap(
+        fp: str | ZipMember,
+        cache_dir: str = None,
+        variant: str = None,
+        transform: callable = None
+) -> tuple[dict, dict]:
+    """
+    Function to load a recording from the cache as memory maps. If there is no
+    valid cache entry, the CSV file is parsed and written to the cache first.
+
+    :param fp: Path to the CSV file or ZipMember.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :param variant: Name of a variant derived from the source file, see
+        cache_entry(). Requires transform.
+    :param transform: Function deriving the variant from the recording, given
+        as Pandas DataFrame. Only called, if there is no valid cache entry.
+    :return: Tuple of a dictionary of memmaps (see read_groups()) and the
+        metadata of the cache entry.
+    """
+    entry = cache_entry(fp, cache_dir=cache_dir, variant=variant)
+    meta = read_meta(entry)
+
+    if not is_valid(meta, fp):
+        recording = read_csv(fp)
+        if transform is not None:
+            recording = transform(recording)
+
+        write_entry(recording, fp, cache_dir=cache_dir, variant=variant)
+        meta = read_meta(entry)
+
+        if not is_valid(meta, fp):
+            raise ValueError(f'Could not write {fp} to the cache.')
+
+    return read_groups(entry, meta), meta
+
+
+def load_cached(
+        fp: str | ZipMember,
+        cache_dir: str = None,
+        columns: list = None,
+        dtype: type = None,
+        time_range: tuple = None,
+        variant: str = None,
+        transform: callable = None
+) -> pd.DataFrame:
+    """
+    Function to load a recording from the cache. If there is no valid cache
+    entry, the CSV file is parsed and written to the cache. The cache always
+    holds all columns, such that other selections can be served later.
+
+    :param fp: Path to the CSV file or ZipMember.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :param columns: List of columns to read. If None (Default), all columns
+        are read.
+    :param dtype: Data type the columns are cast to. If None (Default), the
+        stored data type is kept.
+    :param time_range: Tuple (t0, t1) of timestamps (in seconds). Only rows
+        with t0 <= Timestamp < t1 are read. Either bound may be None. If None
+        (Default), all rows are read.
+    :param variant: Name of a variant derived from the source file, see
+        load_memmap().
+    :param transform: Function deriving the variant, see load_memmap().
+    :return: Recording as Pandas DataFrame.
+    """
+    entry = cache_entry(fp, cache_dir=cache_dir, variant=variant)
+    meta = read_meta(entry)
+
+    if is_valid(meta, fp):
+        rows = None
+        if time_range is not None:
+            timestamp = read_groups(entry, meta)['Timestamp'][:, 0]
+            rows = time_slice(timestamp, time_range)
+
+        return read_entry(entry, meta, columns=columns, dtype=dtype, rows=rows)
+
+    recording = read_csv(fp)
+    if transform is not None:
+        recording = transform(recording)
+
+    if all(pd.api.types.is_numeric_dtype(dt) for dt in recording.dtypes):
+        write_entry(recording, fp, cache_dir=cache_dir, variant=variant)
+
+    return project_recording(recording, columns, dtype, time_range)
+
+
+def time_slice(timestamp: np.ndarray, time_range: tuple) -> slice:
+    """
+    Function to find the rows of a recording within a time range.
+
+    :param timestamp: Sorted timestamps of the recording.
+    :param time_range: Tuple (t0, t1). Rows with t0 <= timestamp < t1 are
+        selected. Either bound may be None.
+    :return: Slice of rows.
+    """
+    t0, t1 = time_range
+    start = 0 if t0 is None else np.searchsorted(timestamp, t0, side='left')
+    stop = (len(timestamp) if t1 is None
+            else np.searchsorted(timestamp, t1, side='left'))
+
+    return slice(int(start), int(stop))
+
+
+def offsets_path(fp: str, cache_dir: str = None) -> str:
+    """
+    Function to get the path of the row-offset index belonging to a CSV file.
+
+    :param fp: Path to the CSV file.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :return: Path to the row-offset index.
+    """
+    return cache_entry(fp, cache_dir=cache_dir) + '.offsets.npz'
+
+
+def build_offsets(fp: str, step: float = 1.0) -> np.ndarray:
+    """
+    Function to build a row-offset index of a CSV file, which maps timestamps
+    to rows and byte offsets. Timestamps are assumed to be sorted.
+
+    :param fp: Path to the CSV file with column "Timestamp" (in seconds).
+    :param step: Interval between entries of the index, in seconds. Defaults
+        to 1 second.
+    :return: NumPy array of shape (n_entries, 3), with columns timestamp, row
+        and byte offset of the first row of each interval.
+    """
+    with open(fp, 'rb') as f:
+        raw = f.read()
+
+    timestamp = pd.read_csv(io.BytesIO(raw), usecols=['Timestamp'])
+    timestamp = timestamp['Timestamp'].to_numpy()
+
+    # Row i starts after the (i + 1)-th line break, the first ends the header
+    newlines = np.flatnonzero(np.frombuffer(raw, dtype=np.uint8) == ord('\n'))
+    starts = newlines[:len(timestamp)] + 1
+
+    intervals = np.floor(timestamp / step)
+    rows = np.concatenate(([0], np.flatnonzero(np.diff(intervals) > 0) + 1))
+
+    return np.column_stack((timestamp[rows], rows, starts[rows]))
+
+
+def load_offsets(
+        fp: str,
+        cache_dir: str = None,
+        step: float = 1.0
+) -> np.ndarray:
+    """
+    Function to load the row-offset index of a CSV file. If there is no valid
+    index, it is built with build_offsets() and stored next to the cache
+    entries.
+
+    :param fp: Path to the CSV file.
+    :param cache_dir: Path to the cache directory. If None (Default), the
+        directory returned by default_cache_dir() is used.
+    :param step: Interval between entries of the index, in seconds.
+    :return: Row-offset index, see build_offsets().
+    """
+    path = offsets_path(fp, cache_dir=cache_dir)
+    signature = source_signature(fp)
+
+    try:
+        with np.load(path) as stored:
+            if (stored['size'] == signature['size']
+                    and stored['mtime_ns'] == signature['mtime_ns']
+                    and stored['step'] == step):
+                return stored['index']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_offsets(fp, step=step)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez(f, index=index, step=step, **signature)
+    except OSError:
+        pass
+
+    return index
+
+
+def read_time_range(
+        fp: str,
+        time_range: tuple,
+        cache_dir: str = None,
+        columns: list = None,
+        dtype: type = None
+) -> pd.DataFrame:
+    """
+    Function to read the rows of a CSV file within a time range. The row-offset
+    index is used to seek to the first needed row and to parse only the rows
+    of the needed intervals.
+
+    :param fp: Path to the CSV file.
+    :param time_range: Tuple (t0, t1), see load_cached().
+    :param cache_dir: Path to the cache directory, where the row-offset index
+        is stored. If None (Default), the directory returned by
+        default_cache_dir() is used.
+    :param columns: List of columns to read, see load_cached().
+    :param dtype: Data type the columns are cast to, see load_cached().
+    :return: Recording as Pandas DataFrame.
+    """
+    index = load_offsets(fp, cache_dir=cache_dir)
+    marks, rows, offsets = index.T
+    t0, t1 = time_range
+
+    first = 0 if t0 is None else max(
+        np.searchsorted(marks, t0, side='right') - 1, 0
+    )
+    last = len(marks) if t1 is None else np.searchsorted(
+        marks, t1, side='right'
+    )
+    nrows = int(rows[last] - rows[first]) if last < len(marks) else None
+
+    with open(fp, 'rb') as f:
+        header = f.readline().decode().strip().split(',')
+        f.seek(int(offsets[first]))
+        usecols = None if columns is None else set(columns) | {'Timestamp'}
+        recording = pd.read_csv(
+            f,
+            header=None,
+            names=header,
+            usecols=usecols,
+            nrows=nrows
+        )
+
+    return project_recording(recording, columns, dtype, time_range)
+
+
+def project_recording(
+        recording: pd.DataFrame,
+        columns: list = None,
+        dtype: type = None,
+        time_range: tuple = None
+) -> pd.DataFrame:
+    """
+    Function to select rows and columns of a recording and cast its data type.
+
+    See the description of load_cached() for a description of keyword
+    arguments.
+    """
+    if time_range is not None:
+        rows = time_slice(recording['Timestamp'].to_numpy(), time_range)
+        recording = recording.iloc[rows].reset_index(drop=True)
+
+    if columns is not None:
+        recording = recording[columns]
+    if dtype is not None:
+        recording = recording.astype(dtype)
+
+    return recording
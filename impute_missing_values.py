@@ -1,5 +1,12 @@
+from collections import Counter
+from multiprocessing.connection import wait
 from pathlib import Path
+import json
+import multiprocessing
+import os
+import time
 import warnings
+from pmdarima.arima import ARIMA
 from pmdarima.arima import StepwiseContext
 from pmdarima.arima import auto_arima
 from tqdm import tqdm
@@ -7,110 +14,553 @@ import numpy as np
 import pandas as pd
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "input_dir",
-    metavar="input-dir",
-    help="Path to the directory with csv files that contain missing values",
-)
-parser.add_argument(
-    "output_dir",
-    metavar="output-dir",
-    help="Path to the directory where resulting csv files will be saved.",
-)
-parser.add_argument(
-    "--overwrite",
-    help="Whether to overwrite the existing files.",
-    action="store_true",
-)
-args = parser.parse_args()
-
-input_dir = Path(args.input_dir)
-output_dir = Path(args.output_dir)
-overwrite = args.overwrite
-
-for csv_file in (pbar := tqdm(list(input_dir.glob("*.csv")))):
-    pbar.set_description(f"Processing {csv_file.name}")
-
-    output_file = output_dir / csv_file.name
-
-    if output_file.exists() and not overwrite:
-        continue
+from utils import parse_path
 
-    df = pd.read_csv(csv_file)
-    eeg_columns = [col for col in df.columns if 'EEG' in col]
+# Default limit of a task (in seconds), a multiple of the 30 seconds of the
+# auto_arima search, which leaves time for fitting the whole series
+TASK_TIMEOUT = 600
 
-    for electrode in (
-        pbar2 := tqdm(eeg_columns, leave=False)
-    ):
-        values = df[electrode].to_numpy()
 
-        # Step 1: Find the missing values
-        # Problem: Missing values are zeros, which in some cases are valid values
-        # Solution: Uninterrupted sequences of at least three zeros (which are
-        #           unlikely to be valid) are considered missing values
+def find_missing(
+        values: np.ndarray,
+        min_length: int = 3
+) -> tuple[np.ndarray, list]:
+    """
+    Function to find missing values in the series of an electrode.
 
-        zeros = 1 * (values == 0)
-        consecutive_zeros = np.zeros_like(zeros)
-        consecutive_zeros[0] = zeros[0]
+    Problem: Missing values are zeros, which in some cases are valid values
+    Solution: Uninterrupted sequences of at least three zeros (which are
+              unlikely to be valid) are considered missing values
 
-        for i in range(1, len(zeros)):
-            if zeros[i] == 1:
-                consecutive_zeros[i] = consecutive_zeros[i - 1] + 1
-            else:
-                consecutive_zeros[i] = 0
-
-        # Go over consecutive_zeros backwards and mark sections with more than 3 zeros
-        missing = np.zeros_like(consecutive_zeros)
-        count = 0
-        for i in range(len(consecutive_zeros)-1, -1, -1):
-            if consecutive_zeros[i] >= 3:
-                count = consecutive_zeros[i]
-            missing[i] = count > 0
-            count -= 1
-
-        if not np.any(missing):
-            continue
-
-        # Step 2: Impute the missing values
-        # The timeseries is modeled as an SARIMA process for which the ar, ma,
-        # and seasonal orders are automatically determined.
-        # A "Kalman smoother" is then used to impute the missing values taking
-        # into account past and future values.
-        # Also see: https://github.com/statsmodels/statsmodels/issues/2551#issuecomment-408735647
-        # and https://github.com/statsmodels/statsmodels/issues/2551#issuecomment-482814921
-        try:
-            pbar2.set_description(
-                f"Imputing missing values for {electrode} (determining model)"
+    :param values: Values of the electrode, as NumPy array.
+    :param min_length: Minimal number of consecutive zeros considered missing.
+        Defaults to 3.
+    :return: Tuple of a boolean mask of the missing values and a list of the
+        gaps, as tuples (start, length).
+    """
+    # Runs of zeros start at +1 and end at -1 of the padded differences
+    edges = np.diff((values == 0).astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+
+    keep = lengths >= min_length
+    starts, lengths = starts[keep], lengths[keep]
+
+    boundaries = np.zeros(len(values) + 1, dtype=int)
+    boundaries[starts] += 1
+    boundaries[starts + lengths] -= 1
+    missing = np.cumsum(boundaries[:-1]) > 0
+
+    return missing, list(zip(starts.tolist(), lengths.tolist()))
+
+
+def impute_electrode(
+        values: np.ndarray,
+        gap_local: bool = False,
+        context: int = 512,
+        order: tuple = None,
+        seasonal_order: tuple = None,
+        start_orders: dict = None
+) -> tuple[np.ndarray, dict] | None:
+    """
+    Function to impute the missing values of an electrode, see find_missing().
+
+    The timeseries is modeled as an SARIMA process for which the ar, ma, and
+    seasonal orders are automatically determined. A "Kalman smoother" is then
+    used to impute the missing values taking into account past and future
+    values.
+    Also see: https://github.com/statsmodels/statsmodels/issues/2551#issuecomment-408735647
+    and https://github.com/statsmodels/statsmodels/issues/2551#issuecomment-482814921
+
+    :param values: Values of the electrode, as NumPy array.
+    :param gap_local: Boolean specifying whether to impute each gap locally,
+        see impute_gaps(). If False (Default), the model is refit on the
+        whole series and all values are replaced by the smoothed series.
+    :param context: Number of samples before and after each gap, which are
+        used for gap-local imputation. Defaults to 512.
+    :param order: See determine_model().
+    :param seasonal_order: See determine_model().
+    :param start_orders: See determine_model().
+    :return: Tuple of imputed values, as NumPy array, and the orders of the
+        model, as dictionary with keys 'order' and 'seasonal_order', or None
+        if no values are missing.
+    """
+    missing, gaps = find_missing(values)
+
+    if not np.any(missing):
+        return None
+
+    model = determine_model(
+        values,
+        order=order,
+        seasonal_order=seasonal_order,
+        start_orders=start_orders
+    )
+    orders = {'order': [int(value) for value in model.order],
+              'seasonal_order': [int(value) for value in model.seasonal_order]}
+
+    values = values.copy()
+    values[missing] = np.nan
+
+    if gap_local:
+        imputed = impute_gaps(model.arima_res_, values, gaps, context=context)
+        return imputed, orders
+
+    model_fit = model.fit(values).arima_res_
+
+    return model_fit.filter_results.smoothed_forecasts[0, :], orders
+
+
+def determine_model(
+        values: np.ndarray,
+        order: tuple = None,
+        seasonal_order: tuple = None,
+        start_orders: dict = None
+) -> ARIMA:
+    """
+    Function to determine the SARIMA model of an electrode, which is fit on
+    the samples 1000 to 3000.
+
+    :param values: Values of the electrode, as NumPy array.
+    :param order: Order (p, d, q) of the model. If given, the stepwise search
+        of auto_arima is skipped and the model is fit with this order.
+    :param seasonal_order: Seasonal order (P, D, Q, m) of the model, used
+        with order. Defaults to no seasonal component.
+    :param start_orders: Orders of a previous model (e.g. of the same
+        participant and electrode), as dictionary with keys 'order' and
+        'seasonal_order'. If given, the stepwise search starts from these
+        orders and uses their differencing, which skips the unit root tests.
+    :return: Fitted model.
+    """
+    if order is not None:
+        model = ARIMA(
+            order=order,
+            seasonal_order=seasonal_order or (0, 0, 0, 0),
+            maxiter=10,
+            suppress_warnings=True,
+        )
+        return model.fit(values[1000:3000])
+
+    search_kwargs = {}
+    if start_orders is not None:
+        p, d, q = start_orders['order']
+        P, D, Q, _ = start_orders['seasonal_order']
+        search_kwargs = {'start_p': p, 'd': d, 'start_q': q,
+                         'start_P': P, 'D': D, 'start_Q': Q}
+
+    with warnings.catch_warnings():
+        # When auto_arima does not finish within the time limit, it raises a
+        # UserWarning
+        warnings.simplefilter("ignore")
+
+        # Limit the maximum duration of the fitting process to 30 seconds
+        # For further optimization, see: https://alkaline-ml.com/pmdarima/tips_and_tricks.html#using-stepwisecontext
+        with StepwiseContext(max_dur=30):
+            return auto_arima(
+                values[1000:3000],
+                seasonal=True,
+                m=5,
+                maxiter=10,
+                suppress_warnings=True,
+                **search_kwargs
             )
 
-            with warnings.catch_warnings():
-                # When auto_arima does not finish within the time limit, it
-                # raises a UserWarning
-                warnings.simplefilter("ignore")
-
-                # Limit the maximum duration of the fitting process to 30 seconds
-                # For further optimization, see: https://alkaline-ml.com/pmdarima/tips_and_tricks.html#using-stepwisecontext
-                with StepwiseContext(max_dur=30):
-                    model = auto_arima(
-                        values[1000:3000],
-                        seasonal=True,
-                        m=5,
-                        maxiter=10,
-                        suppress_warnings=True,
-                    )
-
-            pbar2.set_description(
-                f"Imputing missing values for {electrode} (fitting model)"
+
+def impute_gaps(
+        results,
+        values: np.ndarray,
+        gaps: list,
+        context: int = 512
+) -> np.ndarray:
+    """
+    Function to impute gaps with the parameters of a fitted model, running the
+    Kalman smoother only over a window around each gap instead of the whole
+    series. Windows of nearby gaps are merged and only missing values are
+    replaced, i.e. the cost grows with the total length of gaps.
+
+    :param results: Fitted statsmodels state space results, e.g. the
+        arima_res_ of a model returned by auto_arima.
+    :param values: Values of the electrode, as NumPy array, with missing
+        values set to NaN.
+    :param gaps: List of gaps, as tuples (start, length), see find_missing().
+    :param context: Number of samples before and after each gap. Defaults to
+        512.
+    :return: Imputed values, as NumPy array.
+    """
+    windows = []
+    for start, length in sorted(gaps):
+        begin = max(start - context, 0)
+        end = min(start + length + context, len(values))
+
+        if windows and begin <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([begin, end])
+
+    imputed = values.copy()
+    for begin, end in windows:
+        segment = imputed[begin:end]
+        missing = np.isnan(segment)
+        smoothed = results.apply(values[begin:end]).filter_results
+
+        segment[missing] = smoothed.smoothed_forecasts[0, missing]
+
+    return imputed
+
+
+def _impute_column(
+        csv_file: Path,
+        electrode: str,
+        order_cache: dict = None,
+        **impute_kwargs
+) -> tuple[np.ndarray, dict] | None:
+    """
+    Auxiliary function to read a single electrode of a file and impute it.
+    If an order cache is given, the search starts from the cached orders.
+    """
+    values = pd.read_csv(csv_file, usecols=[electrode])[electrode]
+
+    if order_cache is not None:
+        impute_kwargs['start_orders'] = order_cache.get(
+            _order_key(csv_file, electrode)
+        )
+
+    return impute_electrode(values.to_numpy(dtype=float), **impute_kwargs)
+
+
+def _order_key(csv_file: Path, electrode: str) -> str:
+    """
+    Auxiliary function to get the key of an electrode in the order cache,
+    i.e. "<participant>/<electrode>".
+    """
+    participant = parse_path(str(csv_file)).participant or csv_file.stem
+
+    return f"{participant}/{electrode}"
+
+
+def _read_order_cache(path: str) -> dict:
+    """
+    Auxiliary function to read the order cache written by
+    _write_order_cache(). Returns an empty cache, if it cannot be read.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_order_cache(path: str, order_cache: dict):
+    """
+    Auxiliary function to write the order cache, which maps keys (see
+    _order_key()) to the orders of the last model of the electrode.
+    """
+    tmp = f"{path}.tmp"
+
+    with open(tmp, 'w') as f:
+        json.dump(order_cache, f, indent=2, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def _parse_order(text: str) -> tuple:
+    """
+    Auxiliary function to parse an order given as comma-separated integers,
+    e.g. "2,0,1".
+    """
+    try:
+        return tuple(int(value) for value in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid order '{text}', expected comma-separated integers."
+        )
+
+
+def _task_worker(
+        csv_file: Path,
+        electrode: str,
+        impute_kwargs: dict,
+        connection
+):
+    """
+    Auxiliary function executed in the worker process of a task, which sends
+    a tuple (result, error) through the connection.
+    """
+    try:
+        result = _impute_column(csv_file, electrode, **impute_kwargs)
+        connection.send((result, None))
+    except Exception as e:
+        connection.send((None, str(e)))
+    finally:
+        connection.close()
+
+
+def run_tasks(
+        tasks: list,
+        n_jobs: int = 1,
+        timeout: float = TASK_TIMEOUT,
+        impute_kwargs: dict = None
+):
+    """
+    Generator running the imputation of (file, electrode) tasks.
+
+    With n_jobs > 1 or a timeout, each task runs in its own process, of which
+    at most n_jobs run at the same time. A process exceeding the timeout is
+    terminated, unlike tasks submitted to a process pool, which cannot be
+    stopped once they run.
+
+    :param tasks: List of tuples (csv_file, electrode).
+    :param n_jobs: Number of tasks running in parallel. If -1, one task per
+        CPU core runs. Defaults to 1.
+    :param timeout: Maximal duration of a task (in seconds). Defaults to
+        TASK_TIMEOUT. If None or 0, tasks are not limited.
+    :param impute_kwargs: Keyword arguments passed to impute_electrode().
+    :return: Yields tuples (task, result, error) in the order the tasks
+        finish, where result is the return value of impute_electrode() and
+        error is None or the error message of a failed task. Model orders are
+        returned to the calling process, such that only it writes the order
+        cache.
+    """
+    impute_kwargs = impute_kwargs or {}
+    timeout = timeout or None
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer or -1.")
+
+    if n_jobs == 1 and timeout is None:
+        for task in tasks:
+            try:
+                yield task, _impute_column(*task, **impute_kwargs), None
+            except Exception as e:
+                yield task, None, str(e)
+        return
+
+    pending = iter(tasks)
+    running = {}
+
+    while True:
+        while len(running) < n_jobs and (task := next(pending, None)):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_task_worker,
+                args=(*task, impute_kwargs, sender),
+                daemon=True
             )
+            process.start()
+            sender.close()
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            running[receiver] = (task, process, deadline)
+
+        if not running:
+            return
+
+        deadlines = [deadline for _, _, deadline in running.values()
+                     if deadline is not None]
+        wait_time = (max(min(deadlines) - time.monotonic(), 0)
+                     if deadlines else None)
+
+        for receiver in wait(list(running), timeout=wait_time):
+            task, process, _ = running.pop(receiver)
+            yield task, *_receive(receiver, process)
+
+        now = time.monotonic()
+        for receiver, (task, process, deadline) in list(running.items()):
+            if deadline is None or now < deadline:
+                continue
+
+            del running[receiver]
+
+            # The result may have arrived while the caller processed a
+            # previous result, i.e. after wait() returned
+            if receiver.poll():
+                yield task, *_receive(receiver, process)
+            else:
+                process.terminate()
+                process.join()
+                receiver.close()
+                yield task, None, f"Timed out after {timeout} seconds"
+
+
+def _receive(receiver, process) -> tuple:
+    """
+    Auxiliary function to receive the tuple (result, error) of a finished
+    task and join its process.
+    """
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        process.join()
+        result, error = None, f"Exited with code {process.exitcode}"
+
+    receiver.close()
+    process.join()
+
+    return result, error
 
-            values[missing] = np.nan
-            model_fit = model.fit(values).arima_res_
 
-            df[electrode] = model_fit.filter_results.smoothed_forecasts[0, :]
-        except Exception as e:
+def _write_file(csv_file: Path, output_file: Path, imputed: dict):
+    """
+    Auxiliary function to write a file with its imputed electrodes. Columns
+    are replaced in place, such that the column order is kept.
+    """
+    df = pd.read_csv(csv_file)
+
+    for electrode, values in imputed.items():
+        df[electrode] = values
+
+    df.to_csv(output_file, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_dir",
+        metavar="input-dir",
+        help="Path to the directory with csv files that contain missing values",
+    )
+    parser.add_argument(
+        "output_dir",
+        metavar="output-dir",
+        help="Path to the directory where resulting csv files will be saved.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        help="Whether to overwrite the existing files.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of (file, electrode) tasks processed in parallel. If -1, "
+             "one task per CPU core is processed.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=TASK_TIMEOUT,
+        help="Maximal duration of a task in seconds (default: "
+             f"{TASK_TIMEOUT}). Tasks exceeding it are terminated and the "
+             "electrode is written without imputation. 0 disables the "
+             "limit.",
+    )
+    parser.add_argument(
+        "--gap-local",
+        help="Whether to run the Kalman smoother only around each gap, with "
+             "the parameters determined by auto_arima, instead of refitting "
+             "the model on the whole series. Only missing values are "
+             "replaced.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--context",
+        type=int,
+        default=512,
+        help="Number of samples before and after each gap used with "
+             "--gap-local.",
+    )
+    parser.add_argument(
+        "--order-cache",
+        default=None,
+        help="Path to a JSON file storing the model orders per participant "
+             "and electrode. It is updated with the orders found by the "
+             "search.",
+    )
+    parser.add_argument(
+        "--warm-start",
+        help="Whether to start the search from the cached orders of the "
+             "participant and electrode. Requires --order-cache.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--order",
+        type=_parse_order,
+        default=None,
+        help="Fixed order p,d,q of the model, e.g. 2,0,1. Skips the search.",
+    )
+    parser.add_argument(
+        "--seasonal-order",
+        type=_parse_order,
+        default=None,
+        help="Fixed seasonal order P,D,Q,m of the model, e.g. 1,0,1,5. "
+             "Requires --order.",
+    )
+    args = parser.parse_args()
+
+    if args.warm_start and args.order_cache is None:
+        parser.error("--warm-start requires --order-cache.")
+
+    if args.order is not None and len(args.order) != 3:
+        parser.error("--order requires three values p,d,q.")
+
+    if args.seasonal_order is not None and (
+            args.order is None or len(args.seasonal_order) != 4):
+        parser.error("--seasonal-order requires four values P,D,Q,m and "
+                     "--order.")
+
+    order_cache = ({} if args.order_cache is None
+                   else _read_order_cache(args.order_cache))
+
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
+    overwrite = args.overwrite
+
+    csv_files = [csv_file for csv_file in input_dir.glob("*.csv")
+                 if overwrite or not (output_dir / csv_file.name).exists()]
+
+    # Files are only read when their tasks run, here only the header is read
+    tasks = [
+        (csv_file, electrode) for csv_file in csv_files
+        for electrode in pd.read_csv(csv_file, nrows=0).columns
+        if 'EEG' in electrode
+    ]
+    remaining = Counter(csv_file for csv_file, _ in tasks)
+    imputed = {csv_file: {} for csv_file in csv_files}
+
+    for csv_file in csv_files:
+        if remaining[csv_file] == 0:
+            _write_file(csv_file, output_dir / csv_file.name, {})
+
+    results = tqdm(
+        run_tasks(
+            tasks,
+            n_jobs=args.jobs,
+            timeout=args.timeout,
+            impute_kwargs={
+                'gap_local': args.gap_local,
+                'context': args.context,
+                'order': args.order,
+                'seasonal_order': args.seasonal_order,
+                'order_cache': order_cache if args.warm_start else None
+            }
+        ),
+        total=len(tasks)
+    )
+
+    for (csv_file, electrode), result, error in results:
+        if error is not None:
             print(f"Failed to impute missing values for {electrode} in "
                   f"{csv_file.name}")
-            print(e)
+            print(error)
+        elif result is not None:
+            imputed[csv_file][electrode], orders = result
 
-    df.to_csv(output_file, index=False)
+            if args.order is None:
+                order_cache[_order_key(csv_file, electrode)] = orders
+
+        # Join the electrodes of a file once all of its tasks are finished
+        remaining[csv_file] -= 1
+        if remaining[csv_file] == 0:
+            _write_file(csv_file, output_dir / csv_file.name,
+                        imputed.pop(csv_file))
+
+            if args.order_cache is not None:
+                _write_order_cache(args.order_cache, order_cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,138 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from fractions import Fraction
+from functools import lru_cache, partial
+from itertools import islice
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
-from scipy.signal import butter, sosfiltfilt
+from scipy.signal import butter, resample_poly, sosfilt, sosfiltfilt
+
+from cache import (load_cached, load_memmap, project_recording,
+                   read_time_range, time_slice)
+from utils import (MANIFEST_NAME, RecordingIndex, ZipMember,
+                   get_recording_id, list_zip_members, read_csv)
+
+
+class Recording(NamedTuple):
+    """
+    Recording given as read-only NumPy memmaps of shape (n_samples, n_columns),
+    as returned by load_dataset(backend='mmap').
+    """
+    rec_id: str | None
+    fs: float | None
+    timestamp: np.ndarray
+    eeg: np.ndarray
+    gaze: np.ndarray
+    stimulus: np.ndarray
+    eeg_columns: list
+    gaze_columns: list
+    stimulus_columns: list
+
+
+class RecordingLRU:
+    """
+    Least-recently-used cache of recordings with a memory budget in bytes.
+    """
+    def __init__(self, max_memory: int = None):
+        """
+        :param max_memory: Maximum number of bytes held by the cache. If None
+            (Default), recordings are never evicted.
+        """
+        self.max_memory = max_memory
+        self.memory = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, load: callable):
+        """
+        Get a recording from the cache, loading it if necessary.
+
+        :param key: Key of the recording, i.e. its file path.
+        :param load: Function to load the recording, called with the key.
+        :return: Recording.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key][0]
+
+        recording = load(key)
+        size = _nbytes(recording)
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = recording, size
+                self.memory += size
+
+            while (self.max_memory is not None
+                   and self.memory > self.max_memory and self._items):
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.memory -= evicted_size
+
+        return recording
+
+    def clear(self):
+        """
+        Remove all recordings from the cache.
+        """
+        with self._lock:
+            self._items.clear()
+            self.memory = 0
+
+
+class LazyRecordings(Sequence):
+    """
+    Sequence of recordings, which are only loaded when accessed and then kept
+    in a RecordingLRU, as returned by load_dataset(lazy=True).
+    """
+    def __init__(self, files: list, load: callable, lru: RecordingLRU = None):
+        """
+        :param files: List of file paths.
+        :param load: Function to load a recording, called with its file path.
+        :param lru: Cache of loaded recordings. If None (Default), a cache
+            without memory budget is used.
+        """
+        self.files = list(files)
+        self.load = load
+        self.lru = lru if lru is not None else RecordingLRU()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyRecordings(self.files[index], self.load, self.lru)
+
+        return self.lru.get(self.files[index], self.load)
+
+    def __repr__(self) -> str:
+        return f'LazyRecordings({len(self)} recordings)'
 
-from utils import filter_files
 
 def load_dataset(
         task: str = 'all',
         split: str = 'both',
         exclude: list = None,
         include: list = None,
-        folder: str = None
+        folder: str = None,
+        extract: bool = True,
+        cache: bool = True,
+        cache_dir: str = None,
+        backend: str = 'pandas',
+        columns: list = None,
+        dtype: type = None,
+        time_range: tuple = None,
+        resample: int = None,
+        n_jobs: int = 1,
+        lazy: bool = False,
+        max_memory: int = None
 ) -> tuple | list:
     """
     Function to load the EEG Eye-Tracking Dataset according to specifications.
@@ -33,40 +157,479 @@ def load_dataset(
     :param include: List of recordings to exclude, given in the format
         "PXXX_YY", where XXX denotes the participant number and YY the session
         number.
-    :param folder: Path to folder containing the data. If None (Default), the
-        data is fetched and managed with pooch.
-    :return: Returns a list of Pandas DataFrames, if 'split' in ['train',
-        'test'], and a tuple of both lists, if 'split' == 'both'.
+    :param folder: Path to folder containing the data or to a zip archive of
+        the data. If None (Default), the data is fetched and managed with
+        pooch.
+    :param extract: Boolean specifying whether the data fetched with pooch is
+        extracted. If False, recordings are read directly from the zip archive
+        and only the selected members are decompressed. Defaults to True.
+    :param cache: Boolean specifying whether to use the columnar cache. If
+        True (Default), each CSV file is parsed once and stored as .npy files,
+        which are read on subsequent calls. Cached copies are invalidated when
+        the size or modification time of the CSV file changes.
+    :param cache_dir: Path to the cache directory. If None (Default), the cache
+        is stored next to the data managed by pooch.
+    :param backend: String specifying how recordings are returned. Either of:
+        - "pandas": Returns recordings as Pandas DataFrames (default).
+        - "mmap": Returns recordings as Recording, whose arrays are read-only
+          memory maps of the cache. Processes loading the same recordings
+          share the page cache instead of holding copies. Requires cache=True.
+    :param columns: List of columns to load, e.g. ['EEG_TP9', 'EEG_AF7',
+        'EEG_AF8', 'EEG_TP10', 'Gaze_x', 'Gaze_y']. Other columns are skipped
+        during parsing. If None (Default), all columns are loaded. Not
+        supported by backend 'mmap'.
+    :param dtype: Data type of the loaded columns, e.g. np.float32 to halve
+        the memory. Note that float32 timestamps have a resolution of about
+        0.5 ms after 1 hour. If None (Default), columns are loaded as float64.
+        Not supported by backend 'mmap'.
+    :param time_range: Tuple (t0, t1) of timestamps (in seconds), e.g.
+        (10, 20). Only rows with t0 <= Timestamp < t1 are loaded and either
+        bound may be None. Raises ValueError if t0 > t1. With the cache, the
+        rows are looked up in the cached timestamps. Without the cache, a
+        row-offset index of each CSV file is built once and used to parse only
+        the needed rows. If None (Default), all rows are loaded.
+    :param resample: Sampling rate (in Hz) the recordings are resampled to with
+        resample_recording(), e.g. 64 or 128. With the cache, the resampled
+        recordings are cached as well. If None (Default), the recordings are
+        not resampled.
+    :param n_jobs: Number of threads used to read and parse recordings. If -1,
+        one thread per CPU core is used. Defaults to 1. Parsing CSV files and
+        reading the cache release the GIL, so threads load files in parallel.
+    :param lazy: Boolean specifying whether to load recordings only when they
+        are accessed. If True, LazyRecordings are returned instead of lists.
+        Defaults to False.
+    :param max_memory: Memory budget (in bytes) of the recordings kept by
+        LazyRecordings. Least recently used recordings are evicted, when the
+        budget is exceeded. If None (Default), recordings are never evicted.
+        Only used if lazy=True.
+    :return: Returns a list of recordings, if 'split' in ['train', 'test'],
+        and a tuple of both lists, if 'split' == 'both'.
     """
-    if folder is None:
-        from utils import fetch_data
-        files = fetch_data(
-            task=task,
-            split=split,
-            exclude=exclude,
-            include=include
-        )
-    else:
-        import os
+    _check_time_range(time_range)
 
-        available_files = [os.path.join(root, fp)
-                           for root, _, fps in os.walk(folder) for fp in fps]
-        files = filter_files(
-            available_files,
-            task=task,
-            split=split,
-            exclude=exclude,
-            include=include
+    files = select_files(
+        task=task,
+        split=split,
+        exclude=exclude,
+        include=include,
+        folder=folder,
+        extract=extract
+    )
+
+    def read(fp):
+        return read_recording(
+            fp,
+            cache=cache,
+            cache_dir=cache_dir,
+            backend=backend,
+            columns=columns,
+            dtype=dtype,
+            time_range=time_range,
+            resample=resample
         )
 
+    if lazy:
+        lru = RecordingLRU(max_memory=max_memory)
+
+        if isinstance(files, list):
+            return LazyRecordings(files, read, lru)
+        elif isinstance(files, tuple):
+            return tuple(LazyRecordings(fps, read, lru) for fps in files)
+
     if isinstance(files, list):
-        return [pd.read_csv(fp) for fp in files]
+        return _map_files(read, files, n_jobs)
     elif isinstance(files, tuple):
-        return tuple([pd.read_csv(fp) for fp in fps] for fps in files)
+        files_flat = [fp for fps in files for fp in fps]
+        recordings = _map_files(read, files_flat, n_jobs)
+        n_first = len(files[0])
+        return recordings[:n_first], recordings[n_first:]
     else:
         raise ValueError(f'Files should be a list or tuple.')
 
 
+def _check_time_range(time_range: tuple | None):
+    """
+    Auxiliary function to check a time range (t0, t1), see load_dataset().
+    """
+    if time_range is None:
+        return
+
+    t0, t1 = time_range
+
+    if t0 is not None and t1 is not None and t0 > t1:
+        raise ValueError(
+            f"Invalid time_range {time_range}, t0 must not exceed t1."
+        )
+
+
+def _nbytes(recording: pd.DataFrame | Recording) -> int:
+    """
+    Auxiliary function to estimate the memory held by a recording. Memory maps
+    are backed by the page cache and thus not counted.
+
+    :param recording: Recording as Pandas DataFrame or Recording.
+    :return: Number of bytes.
+    """
+    if isinstance(recording, pd.DataFrame):
+        return int(recording.memory_usage(deep=True).sum())
+
+    return sum(arr.nbytes for arr in recording if isinstance(arr, np.ndarray)
+               and not isinstance(arr, np.memmap))
+
+
+def _map_files(func: callable, files: list, n_jobs: int = 1) -> list:
+    """
+    Auxiliary function to apply a function to a list of files, optionally with
+    a pool of threads. The results are returned in the order of the files.
+
+    :param func: Function that is applied to each file.
+    :param files: List of file paths.
+    :param n_jobs: Number of threads. If -1, one thread per CPU core is used.
+    :return: List of results.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer or -1.")
+
+    if n_jobs == 1 or len(files) < 2:
+        return [func(fp) for fp in files]
+
+    with ThreadPoolExecutor(max_workers=min(n_jobs, len(files))) as executor:
+        return list(executor.map(func, files))
+
+
+def select_files(
+        task: str = 'all',
+        split: str = 'both',
+        exclude: list = None,
+        include: list = None,
+        folder: str = None,
+        extract: bool = True
+) -> tuple | list:
+    """
+    Function to select the files of the EEG Eye-Tracking Dataset according to
+    specifications.
+
+    See the description of load_dataset() for a description of keyword
+    arguments.
+
+    :return: Returns a list of file paths (or ZipMember), if 'split' in
+        ['train', 'test'], and a tuple of both lists, if 'split' == 'both'.
+    """
+    index = load_index(folder=folder, extract=extract)
+
+    return index.select(
+        task=task,
+        split=split,
+        exclude=exclude,
+        include=include
+    )
+
+
+def load_index(folder: str = None, extract: bool = True) -> RecordingIndex:
+    """
+    Function to build the index of all files of the EEG Eye-Tracking Dataset,
+    whose entries hold the metadata parsed relative to the data root.
+
+    :param folder: See load_dataset().
+    :param extract: See load_dataset().
+    :return: RecordingIndex.
+    """
+    if folder is None:
+        from utils import fetch_index
+        return fetch_index(extract=extract)
+    elif os.path.isfile(folder):
+        return RecordingIndex.from_files(
+            list_zip_members(folder),
+            manifest=f'{os.path.splitext(folder)[0]}_{MANIFEST_NAME}'
+        )
+    else:
+        available_files = [os.path.join(root, fp)
+                           for root, _, fps in os.walk(folder) for fp in fps
+                           if fp != MANIFEST_NAME]
+        return RecordingIndex.from_files(
+            available_files,
+            root=folder,
+            manifest=os.path.join(folder, MANIFEST_NAME)
+        )
+
+
+def iterate_windows(
+        window_length: int = 256,
+        stride: int = 32,
+        batch_size: int = 64,
+        task: str = 'all',
+        split: str = 'train',
+        exclude: list = None,
+        include: list = None,
+        folder: str = None,
+        extract: bool = True,
+        shuffle: bool = True,
+        seed: int = None,
+        drop_last: bool = False,
+        cache: bool = True,
+        cache_dir: str = None,
+        shuffle_buffer: int = 1
+):
+    """
+    Generator yielding batches of EEG windows and gaze targets. Recordings are
+    streamed one after another, such that only shuffle_buffer recordings are
+    held at a time. Without shuffling, windows are strided views of the
+    recording and not copied.
+
+    :param window_length: Number of samples per window. Defaults to 256.
+    :param stride: Number of samples between the starts of consecutive windows.
+        Defaults to 32.
+    :param batch_size: Number of windows per batch. Defaults to 64. Batches do
+        not span groups of shuffle_buffer recordings, so the last batch of a
+        group may be smaller.
+    :param task: See load_dataset().
+    :param split: See load_dataset(). If 'both', training and test data are
+        iterated together. Defaults to 'train'.
+    :param exclude: See load_dataset().
+    :param include: See load_dataset().
+    :param folder: See load_dataset().
+    :param extract: See load_dataset().
+    :param shuffle: Boolean specifying whether to shuffle. If True (Default),
+        the order of the recordings is shuffled and the windows of each group
+        of shuffle_buffer consecutive recordings are permuted, such that each
+        batch is a random sample of windows of the group. Batches are then
+        gathered copies instead of views.
+    :param seed: Seed of the random number generator used for shuffling.
+    :param drop_last: Boolean specifying whether to drop the last batch of a
+        group, if it is smaller than batch_size. Defaults to False.
+    :param cache: See load_dataset(). If True (Default), recordings are read as
+        memory maps of the cache.
+    :param cache_dir: See load_dataset().
+    :param shuffle_buffer: Number of recordings whose windows are mixed when
+        shuffling. Defaults to 1, i.e. windows are shuffled within each
+        recording. Larger values mix windows across recordings, at the cost of
+        holding shuffle_buffer recordings at a time. Only used if shuffle=True.
+    :return: Yields tuples (eeg, gaze) of NumPy arrays of shape (batch_size,
+        window_length, n_eeg_channels) and (batch_size, 2), where gaze is
+        given at the last sample of each window. Without shuffling, the arrays
+        are read-only views.
+    """
+    if shuffle_buffer < 1:
+        raise ValueError("shuffle_buffer must be a positive integer.")
+
+    files = select_files(
+        task=task,
+        split=split,
+        exclude=exclude,
+        include=include,
+        folder=folder,
+        extract=extract
+    )
+
+    if isinstance(files, tuple):
+        files = [fp for fps in files for fp in fps]
+
+    rng = np.random.default_rng(seed)
+
+    if shuffle:
+        files = [files[i] for i in rng.permutation(len(files))]
+
+    def read_windows(fp):
+        recording = read_recording(
+            fp,
+            cache=cache,
+            cache_dir=cache_dir,
+            backend='mmap' if cache else 'pandas'
+        )
+
+        if isinstance(recording, pd.DataFrame):
+            eeg_columns = [col for col in recording.columns if 'EEG' in col]
+            eeg = recording[eeg_columns].to_numpy()
+            gaze = recording[['Gaze_x', 'Gaze_y']].to_numpy()
+        else:
+            eeg, gaze = recording.eeg, recording.gaze
+
+        return make_windows(eeg, gaze, window_length, stride)
+
+    if not shuffle:
+        for fp in files:
+            windows, targets = read_windows(fp)
+
+            for start in range(0, len(windows), batch_size):
+                stop = start + batch_size
+
+                if drop_last and stop > len(windows):
+                    continue
+
+                yield windows[start:stop], targets[start:stop]
+
+        return
+
+    for group_start in range(0, len(files), shuffle_buffer):
+        group = [read_windows(fp)
+                 for fp in files[group_start:group_start + shuffle_buffer]]
+        sizes = [len(windows) for windows, _ in group]
+        offsets = np.cumsum([0] + sizes)
+        order = rng.permutation(offsets[-1])
+
+        for start in range(0, len(order), batch_size):
+            # Sorted indices keep the reads from each recording local
+            batch = np.sort(order[start:start + batch_size])
+
+            if drop_last and len(batch) < batch_size:
+                continue
+
+            bounds = np.searchsorted(batch, offsets)
+            eeg_parts, gaze_parts = [], []
+
+            for k, (windows, targets) in enumerate(group):
+                idx = batch[bounds[k]:bounds[k + 1]] - offsets[k]
+
+                if len(idx) > 0:
+                    eeg_parts.append(windows[idx])
+                    gaze_parts.append(targets[idx])
+
+            yield np.concatenate(eeg_parts), np.concatenate(gaze_parts)
+
+
+def make_windows(
+        eeg: np.ndarray,
+        gaze: np.ndarray,
+        window_length: int = 256,
+        stride: int = 32
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to split a recording into windows of EEG data and gaze targets,
+    given as strided views without copying the data.
+
+    :param eeg: EEG data of shape (n_samples, n_channels).
+    :param gaze: Gaze data of shape (n_samples, 2).
+    :param window_length: Number of samples per window. Defaults to 256.
+    :param stride: Number of samples between the starts of consecutive windows.
+        Defaults to 32.
+    :return: Tuple of read-only NumPy arrays of shape (n_windows,
+        window_length, n_channels) and (n_windows, 2), where gaze is given at
+        the last sample of each window.
+    """
+    if len(eeg) < window_length:
+        return (np.empty((0, window_length, eeg.shape[1]), dtype=eeg.dtype),
+                np.empty((0, gaze.shape[1]), dtype=gaze.dtype))
+
+    windows = np.lib.stride_tricks.sliding_window_view(
+        eeg, window_length, axis=0, writeable=False
+    )[::stride].transpose(0, 2, 1)
+    targets = gaze[window_length - 1::stride][:len(windows)]
+    targets.flags.writeable = False
+
+    return windows, targets
+
+
+def read_recording(
+        fp: str | ZipMember,
+        cache: bool = True,
+        cache_dir: str = None,
+        backend: str = 'pandas',
+        columns: list = None,
+        dtype: type = None,
+        time_range: tuple = None,
+        resample: int = None
+) -> pd.DataFrame | Recording:
+    """
+    Function to read a single recording.
+
+    :param fp: Path to the CSV file of the recording or ZipMember.
+    :param cache: Boolean specifying whether to use the columnar cache.
+        Defaults to True.
+    :param cache_dir: Path to the cache directory. If None (Default), the cache
+        is stored next to the data managed by pooch.
+    :param backend: Either "pandas" (default) or "mmap", see load_dataset().
+    :param columns: See load_dataset().
+    :param dtype: See load_dataset().
+    :param time_range: See load_dataset().
+    :param resample: See load_dataset().
+    :return: Recording as Pandas DataFrame or Recording.
+    """
+    _check_time_range(time_range)
+
+    variant = transform = None
+    if resample is not None:
+        variant = f'{resample}Hz'
+        transform = partial(resample_recording, fs_out=resample)
+
+    if backend == 'mmap':
+        if not cache:
+            raise ValueError("Backend 'mmap' requires cache=True.")
+        if columns is not None or dtype is not None:
+            raise ValueError(
+                "Backend 'mmap' does not support columns and dtype."
+            )
+
+        groups, meta = load_memmap(
+            fp,
+            cache_dir=cache_dir,
+            variant=variant,
+            transform=transform
+        )
+        columns = meta['groups']
+
+        if time_range is not None:
+            rows = time_slice(groups['Timestamp'][:, 0], time_range)
+            groups = {group: values[rows] for group, values in groups.items()}
+
+        timestamp = groups.get('Timestamp')
+        empty = np.empty((len(next(iter(groups.values()))), 0))
+
+        return Recording(
+            rec_id=get_recording_id(fp),
+            fs=meta['fs'],
+            timestamp=timestamp[:, 0] if timestamp is not None else None,
+            eeg=groups.get('EEG', empty),
+            gaze=groups.get('Gaze', empty),
+            stimulus=groups.get('Stimulus', empty),
+            eeg_columns=columns.get('EEG', []),
+            gaze_columns=columns.get('Gaze', []),
+            stimulus_columns=columns.get('Stimulus', [])
+        )
+    elif backend != 'pandas':
+        raise ValueError("Backend must be either 'pandas' or 'mmap'.")
+
+    if cache:
+        return load_cached(
+            fp,
+            cache_dir=cache_dir,
+            columns=columns,
+            dtype=dtype,
+            time_range=time_range,
+            variant=variant,
+            transform=transform
+        )
+
+    if transform is not None:
+        return project_recording(
+            transform(read_csv(fp)), columns, dtype, time_range
+        )
+
+    if time_range is not None:
+        if isinstance(fp, ZipMember):
+            # Members of zip archives cannot be seeked, so they are read
+            # entirely
+            return project_recording(read_csv(fp), columns, dtype, time_range)
+
+        return read_time_range(
+            fp,
+            time_range,
+            cache_dir=cache_dir,
+            columns=columns,
+            dtype=dtype
+        )
+
+    recording = read_csv(fp, usecols=columns, dtype=dtype)
+
+    # pd.read_csv returns the columns in the order of the file
+    if columns is not None and list(recording.columns) != list(columns):
+        recording = recording[columns]
+
+    return recording
+
+
 def filter_recording(
         recording: pd.DataFrame,
         notch_50: bool = True,
@@ -74,11 +637,17 @@ def filter_recording(
         bandpass: bool = True,
         fs: int = 256,
         Q: int = 30,
-        bandpass_order: int = 5
+        bandpass_order: int = 5,
+        inplace: bool = False,
+        chunk_size: int = None
 ) -> pd.DataFrame:
     """
     Function to filter EEG data from a recording given as Pandas DataFrame.
 
+    All EEG channels are filtered at once, with the notch and bandpass filters
+    combined into a single cascade of second-order sections, such that the
+    data is passed forward and backward only once.
+
     :param recording: Recording containing EEG data.
     :param notch_50: Boolean specifying whether to apply 50 Hz notch filter.
     :param notch_60: Boolean specifying whether to apply 60 Hz notch filter.
@@ -87,10 +656,343 @@ def filter_recording(
     :param fs: Sample frequency of EEG data. Defaults to 256 Hz.
     :param Q: Quality factor of notch filters. Defaults to 30.
     :param bandpass_order: Order of bandpass filter. Defaults to 5.
-    :return:
+    :param inplace: Boolean specifying whether to overwrite the EEG columns of
+        the given recording instead of filtering a copy. Defaults to False.
+    :param chunk_size: Number of samples filtered at once. If given, the data
+        is read from and written back to the recording in overlapping blocks,
+        padded by the length of the transient of the filter, such that the
+        memory besides the recording (and its copy, unless inplace=True) is
+        proportional to chunk_size. As each block filters chunk_size plus
+        twice the transient, chunk_size is raised to at least the length of
+        the transient (3941 samples with the default filter), see
+        _transient_length(). The maximal absolute deviation from filtering
+        the whole recording is below 1e-6 times the maximal absolute value of
+        the EEG data. Non-float EEG columns are converted to float64 first.
+        If None (Default), the whole recording is filtered at once.
+    :return: Filtered recording.
     """
     eeg_columns = [col for col in recording.columns if 'EEG' in col]
+    sos = design_filter(
+        notch_50=notch_50,
+        notch_60=notch_60,
+        bandpass=bandpass,
+        fs=fs,
+        Q=Q,
+        bandpass_order=bandpass_order
+    )
+
+    recording_filtered = recording if inplace else recording.copy()
+
+    if sos is None or not eeg_columns:
+        return recording_filtered
+
+    if chunk_size is None:
+        data = recording_filtered[eeg_columns].to_numpy(dtype=float)
+        recording_filtered[eeg_columns] = sosfiltfilt(sos, data, axis=0)
+    else:
+        non_float = [col for col in eeg_columns
+                     if not pd.api.types.is_float_dtype(recording[col])]
+        if non_float:
+            recording_filtered[non_float] = (
+                recording_filtered[non_float].astype(float)
+            )
+
+        _sosfiltfilt_chunked(sos, recording_filtered, chunk_size, eeg_columns)
+
+    return recording_filtered
+
+
+def _sosfiltfilt_chunked(
+        sos: np.ndarray,
+        data: np.ndarray | pd.DataFrame,
+        chunk_size: int,
+        columns: list = None,
+        tol: float = 1e-8
+):
+    """
+    Auxiliary function to apply sosfiltfilt along the first axis in
+    overlapping blocks. Each block is padded on both sides by the length of
+    the transient of the filter, which is discarded afterward. Blocks are read
+    from the data and the result is written back in place, such that only
+    the blocks and the unfiltered samples preceding the current block are
+    allocated.
+
+    :param sos: Filter as cascade of second-order sections.
+    :param data: NumPy array of shape (n_samples, n_channels) or Pandas
+        DataFrame, whose columns are filtered in place.
+    :param chunk_size: Number of samples per block, excluding padding. Raised
+        to at least the length of the transient.
+    :param columns: Columns of the DataFrame to filter. Only used if data is
+        a DataFrame.
+    :param tol: Relative magnitude of the impulse response, below which the
+        transient is considered to have decayed.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+
+    if isinstance(data, pd.DataFrame):
+        idx = [data.columns.get_loc(col) for col in columns]
+        dtype = np.result_type(*data.dtypes.iloc[idx])
+
+        def read(start, stop):
+            return data.iloc[start:stop, idx].to_numpy(dtype=float)
+
+        def write(start, stop, values):
+            data.iloc[start:stop, idx] = values.astype(dtype, copy=False)
+    else:
+        def read(start, stop):
+            return data[start:stop]
+
+        def write(start, stop, values):
+            data[start:stop] = values
+
+    pad = _transient_length(sos, tol)
+    chunk_size = max(chunk_size, pad)
+    n_samples = len(data)
+
+    if n_samples <= chunk_size + 2 * pad:
+        write(0, n_samples, sosfiltfilt(sos, read(0, n_samples), axis=0))
+        return
+
+    # Last pad unfiltered samples preceding the current block, which are
+    # already overwritten in data
+    preceding = None
+
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        hi = min(stop + pad, n_samples)
+        current = read(start, hi)
+
+        if preceding is None:
+            preceding = current[:0].copy()
+
+        offset = len(preceding)
+        block = sosfiltfilt(
+            sos, np.concatenate((preceding, current)), axis=0
+        )
+
+        preceding = np.concatenate(
+            (preceding, current[:stop - start])
+        )[-pad:]
+        write(start, stop, block[offset:offset + stop - start])
+
+
+def _transient_length(sos: np.ndarray, tol: float = 1e-8) -> int:
+    """
+    Auxiliary function to estimate the length of the transient of a filter,
+    i.e. the number of samples after which its impulse response stays below
+    tol times its maximum.
+
+    :param sos: Filter as cascade of second-order sections.
+    :param tol: Relative magnitude threshold.
+    :return: Number of samples.
+    """
+    n_samples = 1024
+
+    while True:
+        impulse = np.zeros(n_samples)
+        impulse[0] = 1
+        response = np.abs(sosfilt(sos, impulse))
+        last = np.flatnonzero(response > tol * response.max())[-1] + 1
+
+        if last < n_samples // 2 or n_samples >= 2 ** 24:
+            return int(last)
+
+        n_samples *= 2
+
+
+def resample_recording(
+        recording: pd.DataFrame,
+        fs_out: int,
+        fs: int = 256
+) -> pd.DataFrame:
+    """
+    Function to resample a recording given as Pandas DataFrame.
+
+    All EEG channels are resampled at once with a polyphase anti-aliasing
+    filter. All other columns (timestamps, gaze and stimulus) are taken at the
+    input samples aligned with the output samples, i.e. every k-th sample when
+    decimating by an integer factor k.
+
+    :param recording: Recording containing EEG data.
+    :param fs_out: Sample frequency after resampling, e.g. 64 or 128 Hz.
+    :param fs: Sample frequency of the recording. Defaults to 256 Hz.
+    :return: Resampled recording.
+    """
+    ratio = (Fraction(fs_out) / Fraction(fs)).limit_denominator(1000)
+    up, down = ratio.numerator, ratio.denominator
+
+    # Output sample i corresponds to input time i * down / up
+    n_out = -(-len(recording) * up // down)
+    positions = np.arange(n_out) * down // up
+    resampled = recording.iloc[positions].reset_index(drop=True)
+
+    eeg_columns = [col for col in recording.columns if 'EEG' in col]
+
+    if eeg_columns and len(recording) > 0:
+        data = resample_poly(
+            recording[eeg_columns].to_numpy(dtype=float),
+            up,
+            down,
+            axis=0,
+            padtype='line'
+        )
 
+        for i, col in enumerate(eeg_columns):
+            resampled[col] = data[:, i].astype(recording[col].dtype)
+
+    return resampled
+
+
+def filter_recordings(
+        recordings: list | tuple,
+        n_jobs: int = -1,
+        inplace: bool = False,
+        chunk_size: int = None,
+        **filter_kwargs
+) -> list | tuple:
+    """
+    Function to filter EEG data from many recordings in parallel worker
+    processes. The EEG data is passed to the workers through shared memory,
+    instead of pickling DataFrames.
+
+    :param recordings: List of recordings (as Pandas DataFrame) or tuple of
+        such lists, as returned by load_dataset().
+    :param n_jobs: Number of worker processes. If -1 (Default), one process per
+        CPU core is used.
+    :param inplace: Boolean specifying whether to overwrite the EEG columns of
+        the given recordings instead of filtering copies. Defaults to False.
+    :param chunk_size: See filter_recording(). Limits the memory of the
+        workers, while the recordings are still held in shared memory.
+    :param filter_kwargs: Keyword arguments passed to design_filter(), see
+        filter_recording().
+    :return: Filtered recordings, in the same structure as given.
+    """
+    if isinstance(recordings, tuple):
+        flat = [rec for recs in recordings for rec in recs]
+        filtered = iter(
+            filter_recordings(flat, n_jobs, inplace, chunk_size,
+                              **filter_kwargs)
+        )
+
+        return tuple([next(filtered) for _ in recs] for recs in recordings)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer or -1.")
+
+    sos = design_filter(**filter_kwargs)
+    filtered = [rec if inplace else rec.copy() for rec in recordings]
+
+    if sos is None:
+        return filtered
+
+    def submit(executor, i):
+        eeg_columns = [col for col in filtered[i].columns if 'EEG' in col]
+        data = filtered[i][eeg_columns].to_numpy(dtype=float)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+
+        try:
+            np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+            future = executor.submit(
+                _filter_shared, shm.name, data.shape, sos, chunk_size
+            )
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+        return future, (i, eeg_columns, data.shape, shm)
+
+    # Limit the number of recordings held in shared memory at the same time
+    pending = {}
+    queue = iter(range(len(filtered)))
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            for i in islice(queue, 2 * n_jobs):
+                future, job = submit(executor, i)
+                pending[future] = job
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    i, eeg_columns, shape, shm = pending.pop(future)
+
+                    try:
+                        future.result()
+                        data = np.ndarray(shape, dtype=float, buffer=shm.buf)
+                        filtered[i][eeg_columns] = data.copy()
+                    finally:
+                        shm.close()
+                        shm.unlink()
+
+                    next_i = next(queue, None)
+                    if next_i is not None:
+                        future, job = submit(executor, next_i)
+                        pending[future] = job
+    finally:
+        # After a failure, the executor has waited for the remaining workers,
+        # such that their blocks can be released
+        for _, _, _, shm in pending.values():
+            shm.close()
+            shm.unlink()
+
+    return filtered
+
+
+def _filter_shared(
+        name: str,
+        shape: tuple,
+        sos: np.ndarray,
+        chunk_size: int = None
+):
+    """
+    Auxiliary function to filter EEG data in shared memory along the first
+    axis. Executed by the worker processes of filter_recordings().
+
+    :param name: Name of the shared memory block.
+    :param shape: Shape of the EEG data.
+    :param sos: Filter as cascade of second-order sections.
+    :param chunk_size: See filter_recording().
+    """
+    shm = shared_memory.SharedMemory(name=name)
+
+    try:
+        data = np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+        if chunk_size is None:
+            data[:] = sosfiltfilt(sos, data, axis=0)
+        else:
+            _sosfiltfilt_chunked(sos, data, chunk_size)
+        del data
+    finally:
+        shm.close()
+
+
+@lru_cache
+def design_filter(
+        notch_50: bool = True,
+        notch_60: bool = True,
+        bandpass: bool = True,
+        fs: int = 256,
+        Q: int = 30,
+        bandpass_order: int = 5
+) -> np.ndarray | None:
+    """
+    Function to design the filter applied by filter_recording(), as cascade of
+    second-order sections. Designs are cached.
+
+    See the description of filter_recording() for a description of keyword
+    arguments.
+
+    :return: NumPy array of shape (n_sections, 6) or None, if no filter is
+        applied. The array is shared between calls and must not be modified.
+    """
     nyq = 0.5 * fs  # Nyquist frequency
     f0 = 50 / nyq
     f1 = 60 / nyq
@@ -98,24 +1000,103 @@ def filter_recording(
     high = 40 / nyq
 
     filters = [
-        (notch_50, 2, [f0 - 1 / Q, f0 + 1 / Q], 'bandstop'),
-        (notch_60, 2, [f1 - 1 / Q, f1 + 1 / Q], 'bandstop'),
-        (bandpass, bandpass_order, [low, high], 'bandpass')
+        (notch_50, 2, (f0 - 1 / Q, f0 + 1 / Q), 'bandstop'),
+        (notch_60, 2, (f1 - 1 / Q, f1 + 1 / Q), 'bandstop'),
+        (bandpass, bandpass_order, (low, high), 'bandpass')
     ]
 
-    recording_filtered = recording.copy()
+    sections = [_butter_sos(order, freqs, filter_type)
+                for apply_filter, order, freqs, filter_type in filters
+                if apply_filter]
 
-    for col in eeg_columns:
-        data = recording_filtered[col]
+    if not sections:
+        return None
 
-        for apply_filter, order, freqs, filter_type in filters:
-            if apply_filter:
-                sos = butter(order, freqs, btype=filter_type, output="sos")
-                data = sosfiltfilt(sos, data)
+    return np.vstack(sections)
 
-        recording_filtered[col] = data
 
-    return recording_filtered
+@lru_cache
+def _butter_sos(order: int, frequencies: tuple, btype: str) -> np.ndarray:
+    """
+    Auxiliary function to design a Butterworth filter as second-order sections.
+    Designs are cached.
+
+    :param order: Order of the filter.
+    :param frequencies: Critical frequencies, normalized by Nyquist frequency.
+    :param btype: Type of the filter, e.g. 'bandstop' or 'bandpass'.
+    :return: NumPy array of shape (n_sections, 6).
+    """
+    return butter(order, frequencies, btype=btype, output="sos")
+
+
+class StreamingFilter:
+    """
+    Causal filter for EEG data arriving in chunks, e.g. during live recording.
+
+    The filter is the same cascade as applied by filter_recording(), but
+    applied only forward with sosfilt, while the filter state of each channel
+    is kept between chunks. Hence, the output equals sosfilt(sos, data,
+    axis=0) applied to the concatenation of all chunks.
+    """
+    def __init__(
+            self,
+            n_channels: int = 4,
+            notch_50: bool = True,
+            notch_60: bool = True,
+            bandpass: bool = True,
+            fs: int = 256,
+            Q: int = 30,
+            bandpass_order: int = 5
+    ):
+        """
+        :param n_channels: Number of EEG channels. Defaults to 4.
+
+        See the description of filter_recording() for a description of the
+        remaining keyword arguments.
+        """
+        self.n_channels = n_channels
+        self.sos = design_filter(
+            notch_50=notch_50,
+            notch_60=notch_60,
+            bandpass=bandpass,
+            fs=fs,
+            Q=Q,
+            bandpass_order=bandpass_order
+        )
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the filter state, such that the next chunk is filtered as start
+        of a new recording.
+        """
+        n_sections = 0 if self.sos is None else len(self.sos)
+        self.zi = np.zeros((n_sections, 2, self.n_channels))
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        """
+        Filter the next chunk of EEG data.
+
+        :param chunk: NumPy array of shape (n_samples, n_channels) or
+            (n_channels,) for a single sample.
+        :return: Filtered chunk, of the same shape as the given chunk.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+
+        if chunk.ndim not in (1, 2) or chunk.shape[-1] != self.n_channels:
+            raise ValueError(
+                f"Expected a chunk of shape (n_samples, {self.n_channels}) or "
+                f"({self.n_channels},), got {chunk.shape}."
+            )
+
+        data = chunk.reshape(-1, self.n_channels)
+
+        if self.sos is None or len(data) == 0:
+            return chunk.copy()
+
+        filtered, self.zi = sosfilt(self.sos, data, axis=0, zi=self.zi)
+
+        return filtered.reshape(chunk.shape)
 
 
 if __name__ == '__main__':
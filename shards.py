@@ -0,0 +1,224 @@
+import json
+import os
+
+import numpy as np
+
+from load_data import (filter_recording, make_windows, read_recording,
+                       select_files)
+from utils import get_recording_id
+
+INDEX_NAME = 'index.json'
+
+
+def export_shards(
+        output_dir: str,
+        task: str = 'all',
+        split: str = 'train',
+        window_length: int = 256,
+        stride: int = 32,
+        shard_size: int = 4096,
+        dtype: type = np.float32,
+        filter_eeg: bool = False,
+        filter_kwargs: dict = None,
+        exclude: list = None,
+        include: list = None,
+        folder: str = None,
+        cache: bool = True,
+        cache_dir: str = None
+) -> dict:
+    """
+    Function to export windows of EEG data and gaze targets to shards of fixed
+    size, which can be read without parsing or filtering, see read_shards().
+
+    Each shard consists of the files "shard-XXXXX-eeg.npy" of shape
+    (n_windows, window_length, n_channels) and "shard-XXXXX-gaze.npy" of shape
+    (n_windows, 2). The file "index.json" lists the size of each shard and the
+    recordings it contains.
+
+    :param output_dir: Path to the folder the shards are written to.
+    :param task: See load_dataset().
+    :param split: See load_dataset(). If 'both', training and test data are
+        exported together. Defaults to 'train'.
+    :param window_length: Number of samples per window. Defaults to 256.
+    :param stride: Number of samples between the starts of consecutive windows.
+        Defaults to 32.
+    :param shard_size: Number of windows per shard. Defaults to 4096. Only the
+        last shard may be smaller.
+    :param dtype: Data type of the stored arrays. Defaults to np.float32.
+    :param filter_eeg: Boolean specifying whether to apply filter_recording()
+        before windowing. Defaults to False.
+    :param filter_kwargs: Keyword arguments passed to filter_recording().
+    :param exclude: See load_dataset().
+    :param include: See load_dataset().
+    :param folder: See load_dataset().
+    :param cache: See load_dataset().
+    :param cache_dir: See load_dataset().
+    :return: Index of the shards, as written to "index.json".
+    """
+    files = select_files(
+        task=task,
+        split=split,
+        exclude=exclude,
+        include=include,
+        folder=folder
+    )
+
+    if isinstance(files, tuple):
+        files = [fp for fps in files for fp in fps]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    index = {
+        'window_length': window_length,
+        'stride': stride,
+        'dtype': np.dtype(dtype).name,
+        'filter': (filter_kwargs or {}) if filter_eeg else None,
+        'shards': []
+    }
+    eeg_buffer, gaze_buffer, recordings = [], [], []
+    n_buffered = 0
+
+    def flush():
+        name = f"shard-{len(index['shards']):05d}"
+        np.save(os.path.join(output_dir, f'{name}-eeg.npy'),
+                np.concatenate(eeg_buffer))
+        np.save(os.path.join(output_dir, f'{name}-gaze.npy'),
+                np.concatenate(gaze_buffer))
+        index['shards'].append(
+            {'name': name, 'size': n_buffered, 'recordings': list(recordings)}
+        )
+
+    for fp in files:
+        recording = read_recording(fp, cache=cache, cache_dir=cache_dir)
+
+        if filter_eeg:
+            recording = filter_recording(
+                recording,
+                inplace=True,
+                **(filter_kwargs or {})
+            )
+
+        eeg_columns = [col for col in recording.columns if 'EEG' in col]
+        windows, targets = make_windows(
+            recording[eeg_columns].to_numpy(dtype=dtype),
+            recording[['Gaze_x', 'Gaze_y']].to_numpy(dtype=dtype),
+            window_length=window_length,
+            stride=stride
+        )
+        rec_id = get_recording_id(fp)
+
+        start = 0
+        while start < len(windows):
+            stop = min(start + shard_size - n_buffered, len(windows))
+
+            eeg_buffer.append(windows[start:stop])
+            gaze_buffer.append(targets[start:stop])
+            recordings.append([rec_id, stop - start])
+            n_buffered += stop - start
+            start = stop
+
+            if n_buffered == shard_size:
+                flush()
+                eeg_buffer, gaze_buffer, recordings = [], [], []
+                n_buffered = 0
+
+    if n_buffered > 0:
+        flush()
+
+    with open(os.path.join(output_dir, INDEX_NAME), 'w') as f:
+        json.dump(index, f, indent=2)
+
+    return index
+
+
+def read_index(shard_dir: str) -> dict:
+    """
+    Function to read the index of shards written by export_shards().
+
+    :param shard_dir: Path to the folder containing the shards.
+    :return: Index of the shards.
+    """
+    with open(os.path.join(shard_dir, INDEX_NAME)) as f:
+        return json.load(f)
+
+
+def read_shards(
+        shard_dir: str,
+        batch_size: int = 64,
+        shuffle: bool = False,
+        seed: int = None
+):
+    """
+    Generator yielding batches of EEG windows and gaze targets from shards
+    written by export_shards(). Shards are memory-mapped and read one after
+    another.
+
+    :param shard_dir: Path to the folder containing the shards.
+    :param batch_size: Number of windows per batch. Defaults to 64. Batches do
+        not span shards, so the last batch of a shard may be smaller.
+    :param shuffle: Boolean specifying whether to shuffle the order of the
+        shards and of the windows within each shard. If False (Default),
+        batches are read sequentially as views of the memory-mapped shards.
+    :param seed: Seed of the random number generator used for shuffling.
+    :return: Yields tuples (eeg, gaze) of NumPy arrays of shape (batch_size,
+        window_length, n_channels) and (batch_size, 2).
+    """
+    shards = read_index(shard_dir)['shards']
+    rng = np.random.default_rng(seed)
+
+    if shuffle:
+        shards = [shards[i] for i in rng.permutation(len(shards))]
+
+    for shard in shards:
+        eeg = np.load(os.path.join(shard_dir, f"{shard['name']}-eeg.npy"),
+                      mmap_mode='r')
+        gaze = np.load(os.path.join(shard_dir, f"{shard['name']}-gaze.npy"),
+                       mmap_mode='r')
+
+        if shuffle:
+            order = rng.permutation(len(eeg))
+
+            for start in range(0, len(eeg), batch_size):
+                # Sorted indices keep the reads from the memory map local
+                batch = np.sort(order[start:start + batch_size])
+                yield eeg[batch], gaze[batch]
+        else:
+            for start in range(0, len(eeg), batch_size):
+                yield (eeg[start:start + batch_size],
+                       gaze[start:start + batch_size])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "output_dir",
+        metavar="output-dir",
+        help="Path to the directory where the shards will be saved.",
+    )
+    parser.add_argument("--task", default="all", help="Task to export.")
+    parser.add_argument("--split", default="train", help="Split to export.")
+    parser.add_argument("--folder", default=None, help="Path to the data.")
+    parser.add_argument("--window-length", type=int, default=256)
+    parser.add_argument("--stride", type=int, default=32)
+    parser.add_argument("--shard-size", type=int, default=4096)
+    parser.add_argument(
+        "--filter",
+        help="Whether to filter the EEG data before windowing.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    index = export_shards(
+        args.output_dir,
+        task=args.task,
+        split=args.split,
+        window_length=args.window_length,
+        stride=args.stride,
+        shard_size=args.shard_size,
+        filter_eeg=args.filter,
+        folder=args.folder
+    )
+    print(f"Exported {sum(shard['size'] for shard in index['shards'])} "
+          f"windows to {len(index['shards'])} shards.")
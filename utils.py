@@ -1,11 +1,255 @@
+import json
+import os
+import re
+import zipfile
+from collections import defaultdict
+from typing import NamedTuple
+
+import pandas as pd
 import pooch
 
+MANIFEST_NAME = 'recording_index.json'
+REGISTRY_NAME = 'registry.txt'
+EXTRACTED_FILES_NAME = 'extracted_files.json'
+ZIP_MANIFEST_NAME = 'recording_index_zip.json'
+
+
+class ZipMember(NamedTuple):
+    """
+    CSV file inside a zip archive, which is read without extracting it.
+    """
+    archive: str
+    name: str
+
+
+class RecordingInfo(NamedTuple):
+    """
+    Metadata of a recording, parsed from its file path.
+    """
+    path: str | ZipMember
+    rec_id: str | None
+    participant: str | None
+    session: str | None
+    task: str | None
+    level: int | None
+    paradigm: str | None
+    split: str | None
+
+
+class RecordingIndex:
+    """
+    Index of recordings, which answers selections with exact lookups instead
+    of substring matching on file paths.
+    """
+    def __init__(self, entries: list):
+        """
+        :param entries: List of RecordingInfo.
+        """
+        self.entries = list(entries)
+
+        self._by_key = defaultdict(set)
+        for i, entry in enumerate(self.entries):
+            for key in [('rec_id', entry.rec_id),
+                        ('participant', entry.participant),
+                        ('level', entry.level),
+                        ('paradigm', entry.paradigm),
+                        ('split', entry.split)]:
+                self._by_key[key].add(i)
+
+    @classmethod
+    def from_files(
+            cls,
+            available_files: list,
+            root: str = None,
+            manifest: str = None
+    ) -> 'RecordingIndex':
+        """
+        Build an index from a list of files. If a manifest is given and lists
+        the same files, the parsed metadata is read from the manifest.
+        Otherwise, each path is parsed once and the manifest is (re-)written.
+
+        :param available_files: List of file paths.
+        :param root: Path to the root folder of the data. Only the path
+            relative to root is parsed, such that e.g. a parent folder named
+            "train" does not affect the split. If None (Default), the full
+            path is parsed.
+        :param manifest: Path to the manifest (JSON file). If None (Default),
+            no manifest is used.
+        :return: RecordingIndex.
+        """
+        relative = [_relative_path(fp, root) for fp in available_files]
+
+        if manifest is not None:
+            stored = _read_manifest(manifest)
+
+            if stored is not None and list(stored) == relative:
+                return cls([RecordingInfo(fp, *stored[rel])
+                            for fp, rel in zip(available_files, relative)])
+
+        entries = [parse_path(fp, root=root) for fp in available_files]
+
+        if manifest is not None:
+            _write_manifest(manifest, relative, entries)
+
+        return cls(entries)
+
+    def select(
+            self,
+            task: str = 'all',
+            split: str = 'both',
+            exclude: list = None,
+            include: list = None
+    ) -> tuple | list:
+        """
+        Select files based on specifications.
+
+        See the description of filter_files() for a description of keyword
+        arguments.
+        """
+        selected = set(range(len(self.entries)))
+
+        if task != 'all':
+            level, paradigm = _parse_task(task)
+
+            if level is not None:
+                selected &= self._by_key[('level', level)]
+            if paradigm is not None:
+                selected &= self._by_key[('paradigm', paradigm)]
+
+        if exclude is not None:
+            selected -= self._lookup_recordings(exclude)
+
+        if include is not None:
+            selected &= self._lookup_recordings(include)
+
+        if split not in ['both', 'train', 'test']:
+            raise ValueError(
+                "Split must be either 'both' or 'train' or 'test'."
+            )
+
+        train_file, test_file = (
+            [self.entries[i].path
+             for i in sorted(selected & self._by_key[('split', subset)])]
+            for subset in ['train', 'test']
+        )
+
+        if split == 'both':
+            return train_file, test_file
+        elif split == 'train':
+            return train_file
+        else:
+            return test_file
+
+    def _lookup_recordings(self, rec_ids: list) -> set:
+        """
+        Look up recordings given as "PXXX_YY" or participants given as "PXXX".
+
+        :param rec_ids: List of recording or participant ids.
+        :return: Set of positions of the matching entries.
+        """
+        positions = set()
+        for rec_id in rec_ids:
+            positions |= self._by_key[('rec_id', rec_id)]
+            positions |= self._by_key[('participant', rec_id)]
+
+        return positions
+
+
+def get_recording_id(fp: str) -> str | None:
+    """
+    Function to extract the recording id from a file path.
+
+    :param fp: File path.
+    :return: Recording id in the format "PXXX_YY", where XXX denotes the
+        participant number and YY the session number, or None if the file name
+        does not contain a recording id.
+    """
+    match = re.search(r'P\d{3}_\d{2}', os.path.basename(source_name(fp)))
+
+    return match.group() if match is not None else None
+
+
+def source_name(fp: str | ZipMember) -> str:
+    """
+    Function to get the name of a recording source, i.e. the file path or the
+    name of the member of a zip archive.
+
+    :param fp: File path or ZipMember.
+    :return: Name of the source.
+    """
+    return fp.name if isinstance(fp, ZipMember) else fp
+
+
+def list_zip_members(archive: str) -> list:
+    """
+    Function to list the CSV files of a zip archive. Only the central
+    directory is read, no member is decompressed.
+
+    :param archive: Path to the zip archive.
+    :return: List of ZipMember.
+    """
+    with zipfile.ZipFile(archive) as zf:
+        return [ZipMember(archive, info.filename) for info in zf.infolist()
+                if not info.is_dir() and info.filename.endswith('.csv')]
+
+
+def read_csv(fp: str | ZipMember, **kwargs) -> pd.DataFrame:
+    """
+    Function to read a CSV file, which may be a member of a zip archive.
+    Every call opens its own handle of the archive, such that members can be
+    read from several threads in parallel.
+
+    :param fp: File path or ZipMember.
+    :param kwargs: Keyword arguments passed to pd.read_csv().
+    :return: Pandas DataFrame.
+    """
+    if isinstance(fp, ZipMember):
+        with zipfile.ZipFile(fp.archive) as zf, zf.open(fp.name) as f:
+            return pd.read_csv(f, **kwargs)
+
+    return pd.read_csv(fp, **kwargs)
+
+
+def parse_path(fp: str, root: str = None) -> RecordingInfo:
+    """
+    Function to parse the metadata of a recording from its file path.
+
+    :param fp: File path or ZipMember.
+    :param root: Path to the root folder of the data. If given, only the path
+        relative to root is parsed.
+    :return: RecordingInfo. Fields that cannot be parsed are None.
+    """
+    relative = _relative_path(fp, root)
+    rec_ids = re.findall(r'P\d{3}_\d{2}', relative)
+    tasks = re.findall(r'level-(\d+)-(smooth|saccades)', relative)
+
+    # Split is given by a separate token of a path component, e.g. a folder
+    # "train" or a file "P001_01_train.csv", but not "constrained".
+    tokens = set(re.split(r'[^A-Za-z0-9]+', relative.lower()))
+    splits = [subset for subset in ['train', 'test'] if subset in tokens]
+
+    rec_id = rec_ids[-1] if rec_ids else None
+    level, paradigm = tasks[-1] if tasks else (None, None)
+
+    return RecordingInfo(
+        path=fp,
+        rec_id=rec_id,
+        participant=rec_id.split('_')[0] if rec_id else None,
+        session=rec_id.split('_')[1] if rec_id else None,
+        task=f'level-{level}-{paradigm}' if tasks else None,
+        level=int(level) if tasks else None,
+        paradigm=paradigm,
+        split=splits[0] if len(splits) == 1 else None
+    )
+
+
 def filter_files(
         available_files: list,
         task: str = 'all',
         split: str = 'both',
         exclude: list = None,
-        include: list = None
+        include: list = None,
+        index: RecordingIndex = None
 ) -> tuple | list:
     """
     Function to filter files based on specifications.
@@ -27,75 +271,254 @@ def filter_files(
         - "both": Loads training and test data.
     :param exclude: List of recordings to exclude, given in the format
         "PXXX_YY", where XXX denotes the participant number and YY the session
-        number.
+        number. All recordings of a participant are given by "PXXX".
     :param include: List of recordings to exclude, given in the format
         "PXXX_YY", where XXX denotes the participant number and YY the session
-        number.
+        number. All recordings of a participant are given by "PXXX".
+    :param index: RecordingIndex of available_files. If None (Default), the
+        index is built from available_files.
     :return: Returns a list of file paths, if 'split' in ['train', 'test'], and
         a tuple of both lists, if 'split' == 'both'.
     """
+    if index is None:
+        index = RecordingIndex.from_files(available_files)
 
-    if task == 'all':
-        selected_files = available_files
-    else:
-        selected_files = [fp for fp in available_files if task in fp]
+    return index.select(
+        task=task,
+        split=split,
+        exclude=exclude,
+        include=include
+    )
 
-    if exclude is not None:
-        selected_files = [fp for fp in selected_files
-                          if not any(rec_id in fp for rec_id in exclude)]
 
-    if include is not None:
-        selected_files = [fp for fp in selected_files
-                          if any(rec_id in fp for rec_id in include)]
+def _parse_task(task: str) -> tuple:
+    """
+    Auxiliary function to parse a task specification, e.g. "level-1",
+    "smooth" or "level-2-saccades".
 
-    train_file = [fp for fp in selected_files if 'train' in fp]
-    test_file = [fp for fp in selected_files if 'test' in fp]
+    :param task: Task specification.
+    :return: Tuple of level (or None) and paradigm (or None).
+    """
+    match = re.fullmatch(
+        r'(?:level-)?(?:(\d+)(?:-|$))?(smooth|saccades)?', task
+    )
 
-    if split == 'both':
-        files = train_file, test_file
-    elif split == 'train':
-        files = train_file
-    elif split == 'test':
-        files = test_file
-    else:
-        raise ValueError("Split must be either 'both' or 'train' or 'test'.")
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Unknown task '{task}'.")
+
+    level, paradigm = match.groups()
+
+    return int(level) if level is not None else None, paradigm
+
+
+def _relative_path(fp: str, root: str = None) -> str:
+    """
+    Auxiliary function to get a file path relative to the root folder, with
+    "/" as separator.
+
+    :param fp: File path or ZipMember. Members of zip archives are always
+        given relative to the archive.
+    :param root: Path to the root folder or None.
+    :return: Relative file path.
+    """
+    if isinstance(fp, ZipMember):
+        return fp.name
+
+    if root is not None:
+        fp = os.path.relpath(fp, root)
+
+    return fp.replace(os.sep, '/')
+
+
+def _read_manifest(manifest: str) -> dict | None:
+    """
+    Auxiliary function to read a manifest written by _write_manifest().
+
+    :param manifest: Path to the manifest.
+    :return: Dictionary mapping relative paths to the remaining fields of
+        RecordingInfo or None, if the manifest cannot be read.
+    """
+    try:
+        with open(manifest) as f:
+            return {rel: tuple(fields) for rel, *fields in json.load(f)}
+    except (OSError, ValueError, TypeError):
+        return None
 
-    return files
+
+def _write_manifest(manifest: str, relative: list, entries: list):
+    """
+    Auxiliary function to write a manifest. Failures (e.g. due to a read-only
+    data folder) are ignored, as the manifest can always be rebuilt.
+
+    :param manifest: Path to the manifest.
+    :param relative: List of relative paths.
+    :param entries: List of RecordingInfo.
+    """
+    rows = [[rel, *entry[1:]] for rel, entry in zip(relative, entries)]
+
+    try:
+        with open(manifest, 'w') as f:
+            json.dump(rows, f)
+    except OSError:
+        pass
 
 
 def fetch_data(
         task: str = 'all',
         split: str = 'both',
         exclude: list = None,
-        include: list = None
+        include: list = None,
+        refresh: bool = False,
+        extract: bool = True
 ) -> tuple | list:
     """
     Function to fetch and manage data with the pooch module. The data is only
     downloaded ones.
 
+    The registry resolved from the DOI and the list of extracted files are
+    stored in the cache directory. Subsequent calls use the local files
+    without contacting Zenodo, as long as all extracted files exist.
+
     See the description of filter_files() for a description of keyword arguments.
-    """
-    data_fetcher = pooch.create(
-        path=pooch.os_cache("eeg_eye_tracking"),
-        base_url="doi:10.5281/zenodo.14860668",
-        registry=None,
-    )
 
-    data_fetcher.load_registry_from_doi()
-    available_files = data_fetcher.fetch(
-        "csv_preprocessed.zip",
-        processor=pooch.Unzip()
-    )
+    :param refresh: Boolean specifying whether to resolve the registry from the
+        DOI again and verify the download. Defaults to False.
+    :param extract: Boolean specifying whether to extract the zip archive. If
+        False, ZipMember are returned instead of file paths, which are read
+        directly from the archive. Defaults to True.
+    """
+    index = fetch_index(refresh=refresh, extract=extract)
 
-    selected_files = filter_files(
-        available_files,
+    return index.select(
         task=task,
         split=split,
         exclude=exclude,
         include=include
     )
 
-    return selected_files
+
+def fetch_index(refresh: bool = False, extract: bool = True) -> RecordingIndex:
+    """
+    Function to fetch the data with the pooch module, see fetch_data(), and
+    build the index of all recordings.
+
+    :param refresh: See fetch_data().
+    :param extract: See fetch_data().
+    :return: RecordingIndex of all files, parsed relative to the data root.
+    """
+    path = pooch.os_cache("eeg_eye_tracking")
+    archive = os.path.join(path, "csv_preprocessed.zip")
+    files_file = os.path.join(path, EXTRACTED_FILES_NAME)
+
+    if not extract:
+        if refresh or not os.path.isfile(archive):
+            archive = _fetch_archive(path, refresh=refresh)
+
+        available_files = list_zip_members(archive)
+        index = RecordingIndex.from_files(
+            available_files,
+            manifest=os.path.join(path, ZIP_MANIFEST_NAME)
+        )
+    else:
+        available_files = (None if refresh
+                           else _read_extracted_files(files_file))
+
+        if available_files is None:
+            available_files = _fetch_archive(
+                path,
+                refresh=refresh,
+                processor=pooch.Unzip()
+            )
+            _write_extracted_files(files_file, available_files)
+
+        index = RecordingIndex.from_files(
+            available_files,
+            root=os.path.join(path, "csv_preprocessed.zip.unzip"),
+            manifest=os.path.join(path, MANIFEST_NAME)
+        )
+
+    return index
+
+
+def _fetch_archive(
+        path: str,
+        refresh: bool = False,
+        processor: callable = None
+) -> str | list:
+    """
+    Auxiliary function to fetch the preprocessed data with pooch. The registry
+    is only resolved from the DOI, if it is not stored yet or refresh=True.
+
+    :param path: Path to the cache directory.
+    :param refresh: Boolean specifying whether to resolve the registry again.
+    :param processor: Pooch processor applied after download, e.g. Unzip.
+    :return: Return value of pooch.Pooch.fetch().
+    """
+    registry_file = os.path.join(path, REGISTRY_NAME)
+    data_fetcher = pooch.create(
+        path=path,
+        base_url="doi:10.5281/zenodo.14860668",
+        registry=None,
+    )
+
+    if refresh or not os.path.exists(registry_file):
+        data_fetcher.load_registry_from_doi()
+        _write_registry(registry_file, data_fetcher.registry)
+    else:
+        data_fetcher.load_registry(registry_file)
+
+    return data_fetcher.fetch("csv_preprocessed.zip", processor=processor)
+
+
+def _write_registry(registry_file: str, registry: dict):
+    """
+    Auxiliary function to store a pooch registry in the format read by
+    pooch.Pooch.load_registry().
+
+    :param registry_file: Path to the registry file.
+    :param registry: Dictionary mapping file names to hashes.
+    """
+    with open(registry_file, 'w') as f:
+        f.writelines(f'{name} {known_hash}\n'
+                     for name, known_hash in registry.items())
+
+
+def _read_extracted_files(files_file: str) -> list | None:
+    """
+    Auxiliary function to read the list of extracted files stored by
+    _write_extracted_files().
+
+    :param files_file: Path to the JSON file with the list of files.
+    :return: List of absolute file paths or None, if the list cannot be read
+        or any file is missing.
+    """
+    try:
+        with open(files_file) as f:
+            relative = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    root = os.path.dirname(files_file)
+    available_files = [os.path.join(root, rel) for rel in relative]
+
+    if not available_files or not all(map(os.path.isfile, available_files)):
+        return None
+
+    return available_files
+
+
+def _write_extracted_files(files_file: str, available_files: list):
+    """
+    Auxiliary function to store the list of extracted files relative to the
+    cache directory.
+
+    :param files_file: Path to the JSON file with the list of files.
+    :param available_files: List of absolute file paths.
+    """
+    root = os.path.dirname(files_file)
+
+    with open(files_file, 'w') as f:
+        json.dump([os.path.relpath(fp, root) for fp in available_files], f)
 
 
 if __name__ == '__main__':